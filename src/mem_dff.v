@@ -30,12 +30,13 @@ module spell_mem_dff (
   always @(posedge clock) begin
     if (reset) begin
       cycles <= 0;
+      data_out <= 8'b0;
       data_ready <= 0;
       for (i = 0; i < code_size; i++) code_mem[i] = 0;
       for (i = 0; i < data_size; i++) data_mem[i] = 0;
     end else begin
       if (!select) begin
-        data_out   <= 8'bx;
+        data_out   <= 8'b0;
         data_ready <= 1'b0;
 `ifdef SPELL_DFF_DELAY
         cycles <= 2'b11;
@@ -0,0 +1,101 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Runs the CPI benchmarks of test/test_bench.py on every memory configuration
+
+* dff_delay: code and data in spell_mem_dff, built with SPELL_DFF_DELAY
+* dff: spell_mem_dff without the delay
+* sram: code and data on the rambus_wb_* bus (CTRL_SRAM_ENABLE)
+
+Each configuration runs in its own simulator process, in parallel. Usage::
+
+    python -m test.bench --output bench.json
+
+The output is a JSON object with the git commit and a list of results, one
+per program and configuration: instructions, cycles, CPI, cycles per core
+state, and simulator wall time per simulated cycle.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from test.sim import BUILD_DIR, REPO_ROOT, build_variant, start_vvp
+
+# name: (variant, memory)
+CONFIGS = {
+    "dff_delay": ("rtl", "dff"),
+    "dff": ("rtl_nodelay", "dff"),
+    "sram": ("rtl", "sram"),
+}
+
+
+def git_revision():
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    return result.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the spell CPI benchmarks")
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("configs", nargs="*", help="default: %s" % " ".join(CONFIGS))
+    args = parser.parse_args()
+
+    configs = args.configs or list(CONFIGS)
+    for name in configs:
+        if name not in CONFIGS:
+            parser.error("unknown configuration: %s" % name)
+    workdir = os.path.join(BUILD_DIR, "bench")
+    processes = []
+    for name in configs:
+        variant, memory = CONFIGS[name]
+        config_dir = os.path.join(workdir, name)
+        output = os.path.join(config_dir, "bench.json")
+        if os.path.exists(output):
+            os.remove(output)
+        env = {"SPELL_BENCH_CONFIG": name, "SPELL_BENCH_MEMORY": memory}
+        image = build_variant(variant)
+        process = start_vvp(image, "test.test_bench", config_dir, extra_env=env)
+        processes.append((name, config_dir, process))
+
+    results = []
+    failed = False
+    for name, config_dir, process in processes:
+        process.wait()
+        output = os.path.join(config_dir, "bench.json")
+        if process.returncode or not os.path.exists(output):
+            failed = True
+            print("FAIL: %s (see %s)" % (name, os.path.join(config_dir, "sim.log")))
+            continue
+        with open(output) as f:
+            results += json.load(f)
+
+    columns = ("program", "config", "instrs", "cycles", "CPI", "us/cycle")
+    print("%-12s %-10s %8s %8s %6s %10s" % columns)
+    for result in sorted(results, key=lambda result: (result["program"], result["config"])):
+        print(
+            "%-12s %-10s %8d %8d %6.2f %10.2f"
+            % (
+                result["program"],
+                result["config"],
+                result["instructions"],
+                result["cycles"],
+                result["cpi"],
+                result["wall_us_per_cycle"],
+            )
+        )
+
+    with open(args.output, "w") as f:
+        report = {"revision": git_revision(), "time": time.time(), "results": results}
+        json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Bus transaction and cycle accounting for SpellController
+
+Set SPELL_PROFILE=1 to give every test's SpellController a CallProfile, or set
+one yourself::
+
+    spell.profile = CallProfile("load")
+    await spell.write_program(code)
+    dut._log.info("\\n" + spell.profile.report())
+
+For each high-level call (write_program, execute, exec_step, push and
+ensure_cpu_stopped) it counts the calls, the Wishbone reads and writes, the
+logic analyzer writes, the simulated clock cycles and the Python wall time.
+Counts are inclusive: a write_program row includes the ensure_cpu_stopped
+calls it made, which also have a row of their own. The "test" row covers
+everything since the profile was created, including bus traffic and cycles
+outside of any profiled call.
+
+With SPELL_PROFILE, the table of a test is logged when the next test starts,
+or when the simulator exits for the last one.
+"""
+
+import functools
+import os
+import time
+
+from cocotb.utils import get_sim_time, get_time_from_sim_steps
+from test.perf import clock_period_ns
+
+PROFILE = bool(os.environ.get("SPELL_PROFILE"))
+
+
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.wb_reads = 0
+        self.wb_writes = 0
+        self.la_writes = 0
+        self.sim_steps = 0
+        self.wall_time = 0.0
+
+
+class CallProfile:
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+        self.total = CallStats()
+        self._active = []
+        self._period_ns = clock_period_ns()
+        self._start_steps = get_sim_time()
+        self._start_wall = time.perf_counter()
+
+    def start_call(self, name):
+        """Returns a token for `end_call`"""
+        self._active.append(name)
+        return name, get_sim_time(), time.perf_counter()
+
+    def end_call(self, token):
+        name, start_steps, start_wall = token
+        # Remove the latest entry of this call, which needn't be the last one
+        # when calls run in forked coroutines
+        active = self._active
+        del active[len(active) - 1 - active[::-1].index(name)]
+        stats = self.calls.setdefault(name, CallStats())
+        stats.calls += 1
+        if name not in active:
+            stats.sim_steps += get_sim_time() - start_steps
+            stats.wall_time += time.perf_counter() - start_wall
+
+    def count(self, wb_reads=0, wb_writes=0, la_writes=0):
+        """Adds bus transactions to the test and to every call in progress"""
+        active = [self.calls.setdefault(name, CallStats()) for name in set(self._active)]
+        for stats in [self.total] + active:
+            stats.wb_reads += wb_reads
+            stats.wb_writes += wb_writes
+            stats.la_writes += la_writes
+
+    def finish(self):
+        """Closes the "test" row, at the current time"""
+        self.total.calls = 1
+        self.total.sim_steps = get_sim_time() - self._start_steps
+        self.total.wall_time = time.perf_counter() - self._start_wall
+
+    def cycles(self, stats):
+        """Returns the clock cycles of `stats`, or None if the clock period is not known"""
+        if self._period_ns is None:
+            self._period_ns = clock_period_ns()
+        if not self._period_ns:
+            return None
+        return get_time_from_sim_steps(stats.sim_steps, "ns") / self._period_ns
+
+    def report(self):
+        """Returns the table of calls, by simulated time"""
+        self.finish()
+        total_steps = self.total.sim_steps or 1
+        lines = [
+            "Calls of %s:" % self.name,
+            "%-20s %7s %9s %9s %9s %10s %6s %9s"
+            % ("call", "calls", "wb reads", "wb writes", "la writes", "cycles", "%sim", "wall ms"),
+        ]
+        rows = sorted(self.calls.items(), key=lambda item: -item[1].sim_steps)
+        for name, stats in rows + [("test", self.total)]:
+            cycles = self.cycles(stats)
+            lines.append(
+                "%-20s %7d %9d %9d %9d %10s %5.1f%% %9.1f"
+                % (
+                    name,
+                    stats.calls,
+                    stats.wb_reads,
+                    stats.wb_writes,
+                    stats.la_writes,
+                    "-" if cycles is None else "%d" % cycles,
+                    100.0 * stats.sim_steps / total_steps,
+                    stats.wall_time * 1000,
+                )
+            )
+        return "\n".join(lines)
+
+
+def profiled(method):
+    """Decorates an async SpellController method, to be counted by its `profile`"""
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        profile = self.profile
+        if profile is None:
+            return await method(self, *args, **kwargs)
+        token = profile.start_call(method.__name__)
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            profile.end_call(token)
+
+    return wrapper
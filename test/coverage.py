@@ -0,0 +1,228 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Functional coverage of the spell core
+
+Bins, all kept as counters in one preallocated array('Q'):
+
+* opcode: every opcode of ``spell_execute``, plus one bin for literals,
+* transition: every state change of the ``spell`` state machine,
+* target: every ``spell_mem`` target that was accessed: code and data in
+  spell_mem_dff, the GPIO registers (data addresses 0x20-0x5F), and code and
+  data in the Wishbone SRAM. Instruction fetches count as code accesses,
+* operand: cross of the data opcodes ('?', '!', 'r', 'w') with their target,
+* mode: cross of every opcode bin with the way it was started: a normal run,
+  single_step, or out_of_order_exec (a write to REG_EXEC).
+
+Bins are sampled by CoverageMonitor (test/coverage_monitor.py), which
+create_spell starts in every test when SPELL_COVERAGE names an output file.
+Each simulator process writes the bin counts and the bins hit by each test to
+that file when it exits. Shards are merged and reported with::
+
+    python -m test.runner --module test.test_spell --coverage coverage.json
+    python -m test.coverage report coverage.json
+
+The report ends with a minimal list of tests that hits every covered bin,
+picked greedily, which tells which tests earn their run time.
+"""
+
+import argparse
+import json
+import sys
+from array import array
+
+from test.spell_model import OPCODES
+
+STATES = ["Fetch", "FetchDat", "Execute", "Store", "Delay", "Sleep"]
+TARGETS = ["code_dff", "data_dff", "io", "sram_code", "sram_data"]
+MODES = ["run", "single_step", "out_of_order"]
+
+CODE_DFF, DATA_DFF, IO, SRAM_CODE, SRAM_DATA = range(len(TARGETS))
+MODE_RUN, MODE_SINGLE_STEP, MODE_OUT_OF_ORDER = range(len(MODES))
+
+# Transitions of the state machine in src/spell.v, by state name
+TRANSITIONS = [
+    ("Fetch", "FetchDat"),
+    ("Fetch", "Execute"),
+    ("FetchDat", "Execute"),
+    ("Execute", "Store"),
+    ("Execute", "Delay"),
+    ("Execute", "Fetch"),
+    ("Execute", "Sleep"),
+    ("Store", "Fetch"),
+    ("Store", "Sleep"),
+    ("Delay", "Fetch"),
+    ("Delay", "Sleep"),
+    ("Sleep", "Fetch"),
+    ("Sleep", "FetchDat"),
+    ("Sleep", "Execute"),
+]
+
+# Data opcodes and the targets their operand can be in
+OPERANDS = [
+    (ord("?"), (CODE_DFF, SRAM_CODE)),
+    (ord("!"), (CODE_DFF, SRAM_CODE)),
+    (ord("r"), (DATA_DFF, IO, SRAM_DATA)),
+    (ord("w"), (DATA_DFF, IO, SRAM_DATA)),
+]
+
+
+def _opcode_name(opcode):
+    if opcode is None:
+        return "literal"
+    return "0xff" if opcode == 0xFF else chr(opcode)
+
+
+def _bin_names():
+    """Returns the names of all bins, in counter order, and the index of each group"""
+    names = []
+    groups = {}
+
+    def group(name, bins):
+        groups[name] = (len(names), len(bins))
+        names.extend("%s:%s" % (name, bin_name) for bin_name in bins)
+
+    opcodes = list(OPCODES) + [None]
+    group("opcode", [_opcode_name(opcode) for opcode in opcodes])
+    group("transition", ["%s>%s" % transition for transition in TRANSITIONS])
+    group("target", TARGETS)
+    operands = [(chr(op), TARGETS[target]) for op, targets in OPERANDS for target in targets]
+    group("operand", ["%s/%s" % operand for operand in operands])
+    group("mode", ["%s/%s" % (_opcode_name(opcode), mode) for opcode in opcodes for mode in MODES])
+    return names, groups
+
+
+BINS, GROUPS = _bin_names()
+
+# Opcode byte -> index in the opcode bins, literals share the last one
+OPCODE_INDEX = tuple(
+    OPCODES.index(value) if value in OPCODES else len(OPCODES) for value in range(256)
+)
+
+
+def transition_bins():
+    """Returns a list of 64 bin indices (or None), indexed from_state * 8 + to_state"""
+    bins = [None] * 64
+    start = GROUPS["transition"][0]
+    for index, (from_state, to_state) in enumerate(TRANSITIONS):
+        bins[STATES.index(from_state) * 8 + STATES.index(to_state)] = start + index
+    return bins
+
+
+def operand_bins():
+    """Returns a dict of bin indices, keyed by opcode * 8 + target"""
+    bins = {}
+    start = GROUPS["operand"][0]
+    for opcode, targets in OPERANDS:
+        for target in targets:
+            bins[opcode * 8 + target] = start + len(bins)
+    return bins
+
+
+class Coverage:
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * len(BINS)))
+        # Bins hit by each finished test, as a bitmap in a Python int
+        self.tests = {}
+        self._test = None
+        self._start = None
+
+    def start_test(self, name):
+        """Attributes the bins hit from now on to test `name`"""
+        self.end_test()
+        self._test = name
+        self._start = array("Q", self.counts)
+
+    def end_test(self):
+        if self._test is None:
+            return
+        hits = 0
+        for index, (before, after) in enumerate(zip(self._start, self.counts)):
+            if after != before:
+                hits |= 1 << index
+        self.tests[self._test] = self.tests.get(self._test, 0) | hits
+        self._test = None
+
+    def to_json(self):
+        return {
+            "bins": BINS,
+            "counts": list(self.counts),
+            "tests": {name: "%x" % hits for name, hits in self.tests.items()},
+        }
+
+    def save(self, path):
+        self.end_test()
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f)
+
+    def merge(self, data):
+        """Adds the coverage saved by another process, from `to_json`"""
+        if data["bins"] != BINS:
+            raise ValueError("coverage was recorded with different bins")
+        for index, count in enumerate(data["counts"]):
+            self.counts[index] += count
+        for name, hits in data["tests"].items():
+            self.tests[name] = self.tests.get(name, 0) | int(hits, 16)
+
+    @classmethod
+    def load(cls, paths):
+        coverage = cls()
+        for path in paths:
+            with open(path) as f:
+                coverage.merge(json.load(f))
+        return coverage
+
+    def keep_tests(self):
+        """Returns a minimal list of tests hitting every covered bin, greedy set cover"""
+        remaining = dict(self.tests)
+        covered = 0
+        result = []
+        while remaining:
+            name, hits = max(remaining.items(), key=lambda item: bin(item[1] & ~covered).count("1"))
+            if not hits & ~covered:
+                break
+            result.append(name)
+            covered |= hits
+            del remaining[name]
+        return result
+
+    def report(self):
+        lines = []
+        total_hit = 0
+        for group, (start, length) in GROUPS.items():
+            counts = self.counts[start : start + length]
+            hit = sum(1 for count in counts if count)
+            total_hit += hit
+            lines.append("%-10s %4d / %4d bins" % (group, hit, length))
+            missing = [BINS[start + index] for index, count in enumerate(counts) if not count]
+            if missing:
+                lines.append("  missing: " + " ".join(name.split(":", 1)[1] for name in missing))
+        percent = 100.0 * total_hit / len(BINS)
+        lines.append("total      %4d / %4d bins (%.1f%%)" % (total_hit, len(BINS), percent))
+        keep = self.keep_tests()
+        lines.append(
+            "%d of %d tests hit every covered bin: %s" % (len(keep), len(self.tests), " ".join(keep))
+        )
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge and report spell functional coverage")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge_parser = subparsers.add_parser("merge", help="merge coverage files into one")
+    merge_parser.add_argument("output")
+    merge_parser.add_argument("inputs", nargs="+")
+    report_parser = subparsers.add_parser("report", help="print a coverage report")
+    report_parser.add_argument("inputs", nargs="+")
+    args = parser.parse_args()
+
+    coverage = Coverage.load(args.inputs)
+    if args.command == "merge":
+        coverage.save(args.output)
+    print(coverage.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
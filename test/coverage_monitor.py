@@ -0,0 +1,128 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Samples the functional coverage bins of test/coverage.py
+
+Sampling happens once per retired instruction, on the la_data_out changes that
+RetireMonitor already waits for, and only increments preallocated counters.
+single_step and sram_enable are read from the core when it leaves Sleep, so
+flags written while the core is running count from its next start. On the
+gate-level netlist they read as 0.
+"""
+
+import atexit
+import os
+
+from test.coverage import (
+    CODE_DFF,
+    DATA_DFF,
+    GROUPS,
+    IO,
+    MODE_OUT_OF_ORDER,
+    MODE_RUN,
+    MODE_SINGLE_STEP,
+    MODES,
+    OPCODE_INDEX,
+    SRAM_CODE,
+    SRAM_DATA,
+    Coverage,
+    operand_bins,
+    transition_bins,
+)
+from test.perf import current_test_name
+from test.retire_monitor import STATE_EXECUTE, RetireMonitor
+from test.spell_model import IO_END, IO_START
+
+COVERAGE_FILE = os.environ.get("SPELL_COVERAGE")
+
+STATE_FETCH = 0
+STATE_SLEEP = 5
+
+
+def _flag(handle):
+    if handle is None:
+        return False
+    value = handle.value
+    return value.is_resolvable and bool(value.integer)
+
+
+class CoverageMonitor(RetireMonitor):
+    """Samples the coverage bins of every instruction the core retires"""
+
+    def __init__(self, dut, coverage):
+        self._counts = coverage.counts
+        self._transition_bins = transition_bins()
+        self._operand_bins = operand_bins()
+        self._opcode_base = GROUPS["opcode"][0]
+        self._target_base = GROUPS["target"][0]
+        self._mode_base = GROUPS["mode"][0]
+        self._single_step = getattr(dut, "single_step", None)
+        self._sram_enable = getattr(dut, "sram_enable", None)
+        self._mode = MODE_RUN
+        self._sram = False
+        self._word = None
+        RetireMonitor.__init__(self, "coverage", dut.la_data_out)
+
+    def _state_change(self, prev_state, value):
+        state = (value >> 21) & 0x7
+        if prev_state is not None:
+            transition = self._transition_bins[prev_state * 8 + state]
+            if transition is not None:
+                self._counts[transition] += 1
+            if prev_state == STATE_SLEEP:
+                self._start(state)
+        if state == STATE_EXECUTE:
+            self._word = value
+        elif prev_state == STATE_EXECUTE:
+            self._sample(self._word)
+        RetireMonitor._state_change(self, prev_state, value)
+
+    def _start(self, state):
+        self._sram = _flag(self._sram_enable)
+        if state != STATE_FETCH:
+            # Leaving Sleep for anything but Fetch is a write to REG_EXEC
+            self._mode = MODE_OUT_OF_ORDER
+        elif _flag(self._single_step):
+            self._mode = MODE_SINGLE_STEP
+        else:
+            self._mode = MODE_RUN
+
+    def _sample(self, word):
+        if word is None:
+            return
+        counts = self._counts
+        sram = self._sram
+        opcode = (word >> 8) & 0xFF
+        opcode_index = OPCODE_INDEX[opcode]
+        counts[self._opcode_base + opcode_index] += 1
+        counts[self._mode_base + opcode_index * len(MODES) + self._mode] += 1
+        if self._mode != MODE_OUT_OF_ORDER:
+            counts[self._target_base + (SRAM_CODE if sram else CODE_DFF)] += 1
+        if opcode in b"?!":
+            target = SRAM_CODE if sram else CODE_DFF
+        elif opcode in b"rw":
+            # The address is still on top of the stack in Execute
+            target = IO if IO_START <= word >> 24 < IO_END else SRAM_DATA if sram else DATA_DFF
+        else:
+            return
+        counts[self._target_base + target] += 1
+        counts[self._operand_bins[opcode * 8 + target]] += 1
+
+
+_coverage = None
+
+
+def start_coverage(dut):
+    """
+    Starts sampling coverage for the running test, if SPELL_COVERAGE is set.
+    Returns the monitor, or None. cocotb kills it at the end of the test.
+    """
+    global _coverage
+    if not COVERAGE_FILE:
+        return None
+    if _coverage is None:
+        _coverage = Coverage()
+        atexit.register(_coverage.save, COVERAGE_FILE)
+    _coverage.start_test(current_test_name())
+    return CoverageMonitor(dut, _coverage)
@@ -1,7 +1,32 @@
+// Waveform dumping for the cocotb testbench, see test/waveform.py.
+//
+// Nothing is dumped unless the simulation runs with +dump. Then:
+//   +dumpfile=<name>  output file (default: spell_test.vcd; run vvp with -fst for FST)
+//   +dump_depth=<n>   number of hierarchy levels below spell to dump (default: all)
+//   +dump_on          start dumping at time 0, instead of waiting for the testbench
 module dump ();
+  reg enable;  // Driven from the testbench
+  reg active;
+  reg [8*256-1:0] dumpfile;
+  integer depth;
+
   initial begin
-    $dumpfile("spell_test.vcd");
-    $dumpvars(0, spell);
-    #1;
+    active = 0;
+    enable = $test$plusargs("dump_on");
+    if ($test$plusargs("dump")) begin
+      if (!$value$plusargs("dumpfile=%s", dumpfile)) dumpfile = "spell_test.vcd";
+      if (!$value$plusargs("dump_depth=%d", depth)) depth = 0;
+      $dumpfile(dumpfile);
+      $dumpvars(depth, spell);
+      if (!enable) $dumpoff;
+      active = 1;
+    end
+  end
+
+  always @(enable) begin
+    if (active) begin
+      if (enable) $dumpon;
+      else $dumpoff;
+    end
   end
 endmodule
@@ -0,0 +1,269 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Constrained-random SPELL program generator and fuzz farm
+
+Programs are built from blocks, so that they always terminate and can be
+shrunk by dropping blocks:
+
+* plain blocks: a few opcodes with a known stack effect,
+* ``Loop(count, body)``: ``count, <body>, <body address>, '@'`` runs the body
+  count + 1 times. Every block in a loop body leaves the stack depth unchanged,
+* ``Skip(body)``: ``<address after body>, '=', <body>`` jumps over the body.
+
+The stack never holds more than MAX_STACK entries, counting the pushes inside
+blocks and the counters of running loops. Every program ends with 'z'. Code
+bytes from SCRATCH to the end of the 32-byte code memory are never executed,
+and are the only targets of '!'.
+
+To fuzz the RTL on all cores, run::
+
+    make test_fuzz FUZZ_PROGRAMS=5000
+
+which builds the RTL image (see test/sim.py) and runs ``python -m test.fuzz``. Each worker
+runs test/test_fuzz.py in its own vvp process, with a different seed.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from test.sim import BUILD_DIR, VARIANTS, build_variant, read_results, start_vvp
+from test.spell_model import OPCODES, REG_DDR, REG_PIN, REG_PORT
+
+CODE_SIZE = 32
+DATA_SIZE = 8
+SCRATCH = 24
+MAX_STACK = 30
+MAX_LOOP_DEPTH = 2
+
+LITERALS = [value for value in range(256) if value not in OPCODES]
+# Stack depth change of the opcodes in plain blocks. Literals push one entry.
+STACK_EFFECT = {
+    ord(op): effect
+    for ops, effect in (("2", 1), ("x<>?r", 0), ("+-&|^,=", -1), ("w!", -2))
+    for op in ops
+}
+DATA_ADDRS = list(range(DATA_SIZE)) + [REG_PIN, REG_DDR, REG_PORT]
+SCRATCH_ADDRS = list(range(SCRATCH, CODE_SIZE))
+
+
+class Loop:
+    def __init__(self, count, body):
+        self.count = count
+        self.body = body
+
+
+class Skip:
+    def __init__(self, body):
+        self.body = body
+
+
+def assemble(blocks):
+    """Flattens a block list into opcodes, resolving jump targets"""
+    code = []
+    _emit(blocks, code)
+    code.append(ord("z"))
+    return code
+
+
+def _emit(blocks, code):
+    for block in blocks:
+        if isinstance(block, Loop):
+            code.append(block.count)
+            start = len(code)
+            _emit(block.body, code)
+            code += [start, ord("@")]
+        elif isinstance(block, Skip):
+            target_index = len(code)
+            code += [0, ord("=")]
+            _emit(block.body, code)
+            code[target_index] = len(code)
+        else:
+            code += block
+
+
+def peak_depth(blocks, depth=0):
+    """
+    Returns (highest stack depth, final depth) of running `blocks` from `depth`.
+    A loop keeps its counter on the stack while the body runs, and pushes its
+    body address for '@'. Skipped bodies never run.
+    """
+    peak = depth
+    for block in blocks:
+        if isinstance(block, Loop):
+            body_peak, _ = peak_depth(block.body, depth + 1)
+            peak = max(peak, body_peak, depth + 2)
+        elif isinstance(block, Skip):
+            peak = max(peak, depth + 1)
+        else:
+            for opcode in block:
+                depth += STACK_EFFECT.get(opcode, 0) if opcode in OPCODES else 1
+                peak = max(peak, depth)
+    return peak, depth
+
+
+def format_program(code):
+    return " ".join(
+        repr(chr(opcode)) if opcode in OPCODES and opcode != 0xFF else str(opcode)
+        for opcode in code
+    )
+
+
+class ProgramGenerator:
+    def __init__(self, rng, max_size=SCRATCH):
+        self.rng = rng
+        self.max_size = max_size
+
+    def literal(self):
+        return self.rng.choice(LITERALS)
+
+    def plain_block(self, depth):
+        """Returns a random (block, stack effect) pair, given `depth` usable stack entries"""
+        rng = self.rng
+        kind = rng.choice("lao<x2?rw!,")
+        if kind == "l":
+            return [self.literal()], 1
+        if kind == "a":
+            op = ord(rng.choice("+-&|^"))
+            if depth >= 2:
+                return [op], -1
+            return [self.literal(), self.literal(), op], 1
+        if kind == "<":
+            op = ord(rng.choice("<>"))
+            if depth >= 1:
+                return [op], 0
+            return [self.literal(), op], 1
+        if kind == "x":
+            if depth >= 2:
+                return [ord("x")], 0
+            return [self.literal(), self.literal(), ord("x")], 2
+        if kind == "2":
+            if depth >= 1:
+                return [ord("2")], 1
+            return [self.literal(), ord("2")], 2
+        if kind == "?":
+            return [rng.randrange(CODE_SIZE), ord("?")], 1
+        if kind == "r":
+            return [rng.choice(DATA_ADDRS), ord("r")], 1
+        if kind == "w":
+            if depth >= 1 and rng.random() < 0.5:
+                return [rng.choice(DATA_ADDRS), ord("w")], -1
+            return [self.literal(), rng.choice(DATA_ADDRS), ord("w")], 0
+        if kind == "!":
+            if depth >= 1 and rng.random() < 0.5:
+                return [rng.choice(SCRATCH_ADDRS), ord("!")], -1
+            return [self.literal(), rng.choice(SCRATCH_ADDRS), ord("!")], 0
+        return [rng.randrange(3), ord(",")], 0
+
+    def neutral_block(self, loop_depth):
+        """Returns a block that leaves the stack depth unchanged"""
+        if loop_depth < MAX_LOOP_DEPTH and self.rng.random() < 0.2:
+            return self.loop(loop_depth + 1)
+        block, effect = self.plain_block(0)
+        # Drop whatever the block left behind by storing it to data memory
+        for _ in range(effect):
+            block += [self.rng.randrange(DATA_SIZE), ord("w")]
+        return block
+
+    def loop(self, loop_depth):
+        body = [self.neutral_block(loop_depth) for _ in range(self.rng.randrange(3))]
+        return Loop(self.rng.randrange(4), body)
+
+    def generate(self):
+        rng = self.rng
+        blocks = []
+        depth = 0
+        failed = 0
+        while failed < 4:
+            choice = rng.random()
+            if choice < 0.15:
+                block, effect = self.loop(1), 0
+            elif choice < 0.2:
+                block, effect = Skip([self.plain_block(0)[0]]), 0
+            else:
+                block, effect = self.plain_block(depth)
+            if (
+                peak_depth([block], depth)[0] > MAX_STACK
+                or len(assemble(blocks + [block])) > self.max_size
+            ):
+                failed += 1
+                continue
+            blocks.append(block)
+            depth += effect
+        return blocks
+
+
+def reductions(blocks):
+    """Yields smaller variants of a block list, each still a terminating program"""
+    for index, block in enumerate(blocks):
+        before = blocks[:index]
+        after = blocks[index + 1 :]
+        yield before + after
+        if isinstance(block, Loop):
+            yield before + block.body + after
+            if block.count:
+                yield before + [Loop(0, block.body)] + after
+            for body in reductions(block.body):
+                yield before + [Loop(block.count, body)] + after
+
+
+async def minimize(blocks, still_fails):
+    """
+    Greedily shrinks a failing program. `still_fails` is an async predicate that
+    runs a candidate block list and returns True if it still shows the failure.
+    """
+    reduced = True
+    while reduced:
+        reduced = False
+        for candidate in reductions(blocks):
+            if await still_fails(candidate):
+                blocks = candidate
+                reduced = True
+                break
+    return blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz the spell RTL on multiple cores")
+    parser.add_argument("--variant", default="rtl", choices=sorted(VARIANTS))
+    parser.add_argument("--image", default=None, help="use this image instead of building --variant")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--programs", type=int, default=1000, help="total number of programs")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    image = args.image or build_variant(args.variant)
+    seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+    per_job = -(-args.programs // args.jobs)
+    workdir = os.path.join(BUILD_DIR, "fuzz")
+    print("Fuzzing %d programs on %d jobs, seed %d" % (per_job * args.jobs, args.jobs, seed))
+
+    start = time.perf_counter()
+    workers = []
+    for job in range(args.jobs):
+        job_dir = os.path.join(workdir, "job%d" % job)
+        env = {"SPELL_FUZZ_SEED": str(seed + job), "SPELL_FUZZ_PROGRAMS": str(per_job)}
+        workers.append((job_dir, start_vvp(image, "test.test_fuzz", job_dir, extra_env=env)))
+
+    failed = False
+    for job_dir, process in workers:
+        process.wait()
+        results = read_results(os.path.join(job_dir, "results.xml"))
+        if process.returncode or not results or not all(passed for _, passed, _, _ in results):
+            failed = True
+            print("FAIL: %s (see %s)" % (job_dir, os.path.join(job_dir, "sim.log")))
+            failure_file = os.path.join(job_dir, "failure.txt")
+            if os.path.exists(failure_file):
+                with open(failure_file) as f:
+                    print(f.read())
+
+    print("Done in %.1f s" % (time.perf_counter() - start))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Interrupt-driven host model, for end-to-end throughput measurements
+
+Models the host CPU of the Caravel integration feeding programs to the spell
+core over Wishbone::
+
+    host = HostJobQueue(dut, spell)
+    host.submit(Job([42, 58, "+", "z"]))
+    host.submit(Job([0x36, "r", "z"], io_in=7))
+    results = await host.run()
+    dut._log.info(host.report())
+
+For every job the host loads the program (through the bus, or straight into
+the SRAM when `sram` is set), resets pc and sp, starts the core and waits for
+the interrupt line, without polling. It then reads pc, sp, the top of the
+stack and the interrupt flags, and clears the interrupts before the next job.
+
+Register accesses are counted by the SpellController, including the writes
+that stop the CPU before a push or an exec, so `report()` gives the bus
+operations per job along with the clock cycles spent on host work (loading,
+starting, collecting) and on running programs.
+"""
+
+from collections import deque
+
+import cocotb
+from cocotb.triggers import RisingEdge
+from cocotb.utils import get_sim_time, get_time_from_sim_steps
+from test.spell_model import to_opcode
+from test.test_spell import (
+    CTRL_EDGE_INTERRUPTS,
+    CTRL_RUN,
+    CTRL_SRAM_ENABLE,
+    INTR_SLEEP,
+    INTR_STOP,
+    reg_ctrl,
+    reg_int,
+    reg_int_enable,
+    reg_pc,
+    reg_sp,
+    reg_stack_top,
+)
+
+
+class Job:
+    def __init__(self, code, data=(), io_in=None, name=None):
+        """`data` is written to data memory from address 0, `io_in` drives the input pins"""
+        self.code = [to_opcode(opcode) for opcode in code]
+        self.data = list(data)
+        self.io_in = io_in
+        self.name = name
+
+
+class HostJobQueue:
+    def __init__(self, dut, spell, sram=False, edge_interrupts=False):
+        self._dut = dut
+        self._spell = spell
+        self._jobs = deque()
+        self._ctrl = CTRL_RUN
+        if sram:
+            self._ctrl |= CTRL_SRAM_ENABLE
+        if edge_interrupts:
+            self._ctrl |= CTRL_EDGE_INTERRUPTS
+        self._armed = False
+        self._period = None
+        self.jobs = 0
+        self.bus_ops = 0
+        self.host_time = 0
+        self.run_time = 0
+
+    def submit(self, job):
+        self._jobs.append(job)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    async def run(self):
+        """Runs every queued job in order. Returns a list of result dicts."""
+        results = []
+        while self._jobs:
+            results.append(await self.run_job(self._jobs.popleft()))
+        return results
+
+    async def run_job(self, job):
+        spell = self._spell
+        if self._period is None:
+            self._period = await spell.clock_period_steps()
+        start = get_sim_time()
+        bus_ops = spell.bus_ops()
+        batch = spell.batch()
+        if not self._armed:
+            # The sleep and stop interrupts stay enabled for the whole queue
+            batch.write(reg_int, INTR_SLEEP | INTR_STOP)
+            batch.write(reg_int_enable, INTR_SLEEP | INTR_STOP)
+            await batch.send()
+            self._armed = True
+        await self._load(job)
+        if job.io_in is not None:
+            self._dut.io_in.value = job.io_in
+
+        batch.set_pc(0)
+        batch.set_sp(0)
+        batch.write(reg_ctrl, self._ctrl)
+        # Wait from before the start, so that a short program can't race us
+        interrupt = cocotb.fork(self._wait_interrupt())
+        await batch.send()
+        started = get_sim_time()
+        await interrupt
+        finished = get_sim_time()
+
+        for addr in (reg_int, reg_pc, reg_sp, reg_stack_top):
+            batch.read(addr)
+        batch.write(reg_int, INTR_SLEEP | INTR_STOP)
+        flags, pc, sp, top = [int(value) for value in await batch.send()]
+
+        self.jobs += 1
+        self.bus_ops += spell.bus_ops() - bus_ops
+        self.host_time += (started - start) + (get_sim_time() - finished)
+        self.run_time += finished - started
+        return {
+            "name": job.name,
+            "pc": pc,
+            "sp": sp,
+            "top": top,
+            "stopped": bool(flags & INTR_STOP),
+            "io_out": self._dut.io_out.value.integer,
+        }
+
+    async def _load(self, job):
+        spell = self._spell
+        if self._ctrl & CTRL_SRAM_ENABLE:
+            # The host writes the SRAM on its own bus
+            spell.sram[0 : len(job.code)] = bytes(job.code)
+            spell.sram[256 : 256 + len(job.data)] = bytes(job.data)
+            return
+        batch = spell.batch()
+        for opcode, addr, values in (("!", 0, job.code), ("w", 0, job.data)):
+            for index, value in enumerate(values):
+                batch.push(value)
+                batch.push(addr + index)
+                batch.exec(opcode)
+                await batch.send()
+
+    async def _wait_interrupt(self):
+        interrupt = self._dut.interrupt
+        if self._ctrl & CTRL_EDGE_INTERRUPTS:
+            # A one-cycle pulse, which is only seen on its rising edge
+            await RisingEdge(interrupt)
+            return
+        while not interrupt.value:
+            await RisingEdge(interrupt)
+
+    def report(self):
+        """
+        Returns throughput in jobs per simulated second, and the bus operations and
+        clock cycles spent per job on host work and on running the programs.
+        """
+        jobs = max(self.jobs, 1)
+        total = self.host_time + self.run_time
+        seconds = get_time_from_sim_steps(total, "sec")
+        period = self._period or 1
+        return {
+            "jobs": self.jobs,
+            "sim_seconds": seconds,
+            "jobs_per_second": self.jobs / seconds if seconds else 0.0,
+            "bus_ops_per_job": self.bus_ops / jobs,
+            "host_cycles_per_job": self.host_time / period / jobs,
+            "run_cycles_per_job": self.run_time / period / jobs,
+            "host_overhead": self.host_time / total if total else 0.0,
+        }
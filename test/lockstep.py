@@ -0,0 +1,58 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Lockstep co-simulation of the spell core against the Python reference model
+
+Usage example::
+
+    model = SpellModel()
+    model.load_code(program)
+    await spell.load_code(program)
+
+    checker = LockstepChecker(dut, model)
+    await spell.execute()
+    checker.stop()
+
+Every instruction retired by the RTL steps the model once and compares pc,
+opcode, sp and stack top. The test fails at the first mismatch, with the last
+few retired instructions in the message. The model only follows instructions
+fetched from code memory, so don't use REG_EXEC (exec_step, write_program)
+while the checker is running.
+"""
+
+from collections import deque
+
+from test.retire_monitor import RetireMonitor, format_la
+
+# Everything in la_data_out except the state bits
+COMPARE_MASK = 0xFF1FFFFF
+
+
+class LockstepChecker:
+    def __init__(self, dut, model, history=16):
+        self._model = model
+        self._history = deque(maxlen=history)
+        self.checked = 0
+        self._monitor = RetireMonitor("lockstep", dut.la_data_out, callback=self._check)
+
+    def stop(self):
+        self._monitor.kill()
+
+    def _check(self, value):
+        self._model.step()
+        self._history.append(value)
+        self.checked += 1
+        expected = self._model.pack()
+        if value & COMPARE_MASK != expected:
+            raise AssertionError(self._report(value, expected))
+
+    def _report(self, value, expected):
+        lines = [
+            "RTL diverged from the reference model at instruction #%d" % self.checked,
+            "  expected: %s" % format_la(expected, with_state=False),
+            "  actual:   %s" % format_la(value, with_state=False),
+            "Last %d retired instructions:" % len(self._history),
+        ]
+        lines += ["  " + format_la(entry) for entry in self._history]
+        return "\n".join(lines)
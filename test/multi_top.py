@@ -0,0 +1,120 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Generates and runs `spell_multi`, a testbench top with N independent spell cores
+
+Short tests spend most of their time starting the simulator and Python. With
+N cores in one simulation, one vvp process runs N programs at once and shares
+that cost, along with the clock: every core runs on the same `clock`, and has
+its own reset, Wishbone host port, logic analyzer port, RAM bus and GPIO.
+
+Each core is instance ``core<i>``. Its inputs are driven from regs named
+``core<i>_<port>`` in the top module, its outputs are read from the instance.
+`CoreHandle` in test/test_multi.py makes one core look like the `spell` top
+to SpellController. Build and run with::
+
+    python -m test.multi_top --cores 8 --module test.test_multi
+"""
+
+import argparse
+import os
+import sys
+
+from test.sim import BUILD_DIR, REPO_ROOT, RTL_SOURCES, build_image, run_vvp
+
+TOP = "spell_multi"
+
+# Input ports of spell, as (name, width). The clock is shared.
+INPUTS = [
+    ("reset", 1),
+    ("i_la_write", 1),
+    ("i_la_addr", 7),
+    ("i_la_data", 8),
+    ("i_la_wb_disable", 1),
+    ("i_wb_cyc", 1),
+    ("i_wb_stb", 1),
+    ("i_wb_we", 1),
+    ("i_wb_addr", 32),
+    ("i_wb_data", 32),
+    ("io_in", 8),
+    ("rambus_wb_ack_i", 1),
+    ("rambus_wb_dat_i", 32),
+]
+
+OUTPUTS = [
+    "la_data_out",
+    "o_wb_ack",
+    "o_wb_data",
+    "io_out",
+    "io_oeb",
+    "rambus_wb_clk_o",
+    "rambus_wb_rst_o",
+    "rambus_wb_stb_o",
+    "rambus_wb_cyc_o",
+    "rambus_wb_we_o",
+    "rambus_wb_sel_o",
+    "rambus_wb_dat_o",
+    "rambus_wb_addr_o",
+    "interrupt",
+]
+
+
+def generate_wrapper(cores):
+    """Returns the Verilog source of a `spell_multi` top with `cores` spell instances"""
+    lines = [
+        "// Generated by test/multi_top.py, do not edit",
+        "`default_nettype none",
+        "`timescale 1ns / 1ps",
+        "",
+        "module %s ();" % TOP,
+        "  reg clock;",
+    ]
+    for index in range(cores):
+        prefix = "core%d_" % index
+        lines.append("")
+        for name, width in INPUTS:
+            vector = "[%d:0] " % (width - 1) if width > 1 else ""
+            lines.append("  reg %s%s%s;" % (vector, prefix, name))
+        connections = [".clock(clock)"]
+        connections += [".%s(%s%s)" % (name, prefix, name) for name, _ in INPUTS]
+        connections += [".%s()" % name for name in OUTPUTS]
+        lines.append("  spell core%d (" % index)
+        lines.append(",\n".join("      " + connection for connection in connections))
+        lines.append("  );")
+    lines.append("endmodule")
+    return "\n".join(lines) + "\n"
+
+
+def build_multi(cores):
+    """Writes the wrapper for `cores` cores and builds it. Returns the image path."""
+    source = os.path.join(BUILD_DIR, "multi", "%s_%d.v" % (TOP, cores))
+    os.makedirs(os.path.dirname(source), exist_ok=True)
+    text = generate_wrapper(cores)
+    if not os.path.exists(source) or open(source).read() != text:
+        with open(source, "w") as f:
+            f.write(text)
+    sources = RTL_SOURCES + [os.path.relpath(source, REPO_ROOT)]
+    return build_image(sources, [TOP], ["SPELL_DFF_DELAY"], ["src"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a cocotb module on N spell cores at once")
+    parser.add_argument("--cores", type=int, default=os.cpu_count())
+    parser.add_argument("--module", default="test.test_multi")
+    parser.add_argument("--programs", type=int, default=None, help="fuzz programs, in total")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--testcase", default=None)
+    args = parser.parse_args()
+
+    image = build_multi(args.cores)
+    env = {"TOPLEVEL": TOP}
+    if args.programs is not None:
+        env["SPELL_FUZZ_PROGRAMS"] = str(args.programs)
+    if args.seed is not None:
+        env["SPELL_FUZZ_SEED"] = str(args.seed)
+    run_vvp(image, args.module, args.testcase, extra_env=env)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Simulation performance history, per test
+
+Every simulator process notes the clock period of each test (`start_test`,
+called by make_clock) and the process's maximum RSS at the start and end of
+the test in perf.json, or SPELL_PERF if set. The maximum RSS is a high-water
+mark of the whole process, so it only gives the peak RSS of a test when the
+test ran alone in its process, as with test.runner's default one-test
+shards. Otherwise, as with ``make test_spell``, only the growth of the
+high-water mark during the test is known: later tests show 0 unless they
+use more memory than every test before them.
+
+After a run, `record` adds one line per test to the history file, combining
+perf.json with the wall and simulated time of the test from results.xml::
+
+    python -m test.perf record results.xml --variant rtl
+    python -m test.perf baseline                  # the last run becomes the baseline
+    python -m test.perf compare --threshold 1.25  # flags tests that got slower
+
+Each history line is a JSON object with the run id, time, git revision,
+variant, test name, pass/fail, wall_s, sim_ns, cycles, cycles_per_s,
+peak_rss_kb (null unless the test ran alone in its process) and
+rss_growth_kb. `compare` checks the latest run against the baseline and fails
+when a test's wall time or peak RSS grew by more than the threshold, or its
+simulated cycles per second dropped by more than the threshold. Peak RSS is
+only compared where both runs know it; rss_growth_kb is recorded but not
+compared, as it depends on the tests that ran before. Tests faster than
+--min-wall seconds are only checked for RSS, as their wall time is noise.
+
+test.runner records every run into perf_history.jsonl by default.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import resource
+import sys
+import time
+
+from test.sim import read_results
+
+PERF_FILE = os.environ.get("SPELL_PERF", "perf.json")
+HISTORY_FILE = "perf_history.jsonl"
+BASELINE_FILE = "perf_baseline.json"
+
+_tests = None
+_current = None
+
+
+def current_test_name():
+    import cocotb
+
+    test = getattr(cocotb.regression_manager, "_test", None)
+    return getattr(test, "__name__", "unknown")
+
+
+def _peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _end_test():
+    if _current is not None:
+        _tests[_current]["maxrss_end_kb"] = _peak_rss_kb()
+
+
+def _save():
+    _end_test()
+    with open(PERF_FILE, "w") as f:
+        json.dump(_tests, f, indent=2)
+
+
+def start_test(clock_period_ns):
+    """Notes the clock period of the running test, and the maximum RSS at its start"""
+    global _tests, _current
+    if _tests is None:
+        _tests = {}
+        atexit.register(_save)
+    _end_test()
+    _current = current_test_name()
+    _tests[_current] = {
+        "clock_period_ns": clock_period_ns,
+        "maxrss_start_kb": _peak_rss_kb(),
+        "maxrss_end_kb": None,
+    }
+
+
+def clock_period_ns():
+    """Returns the clock period of the running test, as passed to make_clock, or None"""
+    if _current is None:
+        return None
+    return _tests[_current]["clock_period_ns"]
+
+
+def git_revision():
+    from test.bench import git_revision
+
+    return git_revision()
+
+
+def make_records(results_files, perf_files, variant, run=None):
+    """Returns a history record per test in the results.xml files"""
+    perf = {}
+    for path in perf_files:
+        if os.path.exists(path):
+            with open(path) as f:
+                tests = json.load(f)
+            for test in tests.values():
+                start, end = test.get("maxrss_start_kb"), test.get("maxrss_end_kb")
+                # The high-water mark is only this test's peak if nothing else ran
+                test["peak_rss_kb"] = end if len(tests) == 1 else None
+                test["rss_growth_kb"] = end - start if start is not None and end else None
+            perf.update(tests)
+    now = time.time()
+    run = run or "%d-%d" % (now, os.getpid())
+    revision = git_revision()
+    records = []
+    for path in results_files:
+        for name, passed, wall, sim_ns in read_results(path):
+            test = perf.get(name, {})
+            period = test.get("clock_period_ns")
+            cycles = int(sim_ns / period) if period else None
+            records.append(
+                {
+                    "run": run,
+                    "time": now,
+                    "revision": revision,
+                    "variant": variant,
+                    "test": name,
+                    "passed": passed,
+                    "wall_s": wall,
+                    "sim_ns": sim_ns,
+                    "cycles": cycles,
+                    "cycles_per_s": cycles / wall if cycles is not None and wall else None,
+                    "peak_rss_kb": test.get("peak_rss_kb"),
+                    "rss_growth_kb": test.get("rss_growth_kb"),
+                }
+            )
+    return records
+
+
+def append_history(records, path=HISTORY_FILE):
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def load_history(path=HISTORY_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def last_run(history, variant=None):
+    """Returns the records of the most recent run, of `variant` if given"""
+    if variant:
+        history = [record for record in history if record["variant"] == variant]
+    if not history:
+        return []
+    run = history[-1]["run"]
+    return [record for record in history if record["run"] == run]
+
+
+def compare(current, baseline, threshold=1.25, min_wall=0.5):
+    """
+    Returns a list of (test, metric, baseline value, current value) for every
+    regression beyond `threshold`, a ratio.
+    """
+    base = {record["test"]: record for record in baseline}
+    regressions = []
+    for record in current:
+        before = base.get(record["test"])
+        if before is None or not record["passed"]:
+            continue
+        checks = [("peak_rss_kb", True)]
+        if before["wall_s"] >= min_wall:
+            checks += [("wall_s", True), ("cycles_per_s", False)]
+        for metric, higher_is_worse in checks:
+            old, new = before.get(metric), record.get(metric)
+            if not old or not new:
+                continue
+            ratio = new / old if higher_is_worse else old / new
+            if ratio > threshold:
+                regressions.append((record["test"], metric, old, new))
+    return regressions
+
+
+def format_comparison(current, baseline):
+    base = {record["test"]: record for record in baseline}
+    lines = ["%-32s %9s %9s %12s %12s %9s" % ("test", "wall", "base", "cycles/s", "base", "rss MB")]
+    for record in current:
+        before = base.get(record["test"], {})
+        rss = record.get("peak_rss_kb")
+        lines.append(
+            "%-32s %8.2fs %8.2fs %12.0f %12.0f %9s"
+            % (
+                record["test"],
+                record["wall_s"],
+                before.get("wall_s") or 0.0,
+                record["cycles_per_s"] or 0.0,
+                before.get("cycles_per_s") or 0.0,
+                "-" if rss is None else "%.1f" % (rss / 1024),
+            )
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Track simulation performance per test")
+    parser.add_argument("--history", default=HISTORY_FILE)
+    parser.add_argument("--baseline-file", default=BASELINE_FILE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="add a run to the history")
+    record_parser.add_argument("results", nargs="+", help="results.xml files")
+    record_parser.add_argument(
+        "--perf", nargs="*", default=None, help="perf.json files, default: next to each results.xml"
+    )
+    record_parser.add_argument("--variant", default="rtl")
+    baseline_parser = subparsers.add_parser("baseline", help="make the last run the baseline")
+    baseline_parser.add_argument("--variant", default=None)
+    compare_parser = subparsers.add_parser("compare", help="compare the last run to the baseline")
+    compare_parser.add_argument("--variant", default=None)
+    compare_parser.add_argument("--threshold", type=float, default=1.25)
+    compare_parser.add_argument("--min-wall", type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        perf_files = args.perf
+        if perf_files is None:
+            perf_files = [os.path.join(os.path.dirname(path), "perf.json") for path in args.results]
+        records = make_records(args.results, perf_files, args.variant)
+        append_history(records, args.history)
+        print("Recorded %d tests in %s" % (len(records), args.history))
+        return 0
+
+    current = last_run(load_history(args.history), args.variant)
+    if not current:
+        print("No runs in %s" % args.history)
+        return 1
+    if args.command == "baseline":
+        with open(args.baseline_file, "w") as f:
+            json.dump(current, f, indent=2)
+        print("Baseline: run %s, %d tests" % (current[0]["run"], len(current)))
+        return 0
+
+    if not os.path.exists(args.baseline_file):
+        print("No baseline, create one with: python -m test.perf baseline")
+        return 1
+    with open(args.baseline_file) as f:
+        baseline = json.load(f)
+    print(format_comparison(current, baseline))
+    regressions = compare(current, baseline, args.threshold, args.min_wall)
+    for test, metric, old, new in regressions:
+        print("SLOWER: %s %s %.4g -> %.4g" % (test, metric, old, new))
+    print("%d regressions beyond %.2fx" % (len(regressions), args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+from cocotb.triggers import Edge, ReadOnly
+from cocotb_bus.monitors import Monitor
+
+STATE_EXECUTE = 2
+
+_state_names = ["Fetch", "FetchDat", "Execute", "Store", "Delay", "Sleep"]
+
+
+def format_la(value, with_state=True):
+    """Formats a la_data_out word for humans"""
+    opcode = (value >> 8) & 0xFF
+    text = "pc=%3d opcode=%-4s sp=%2d top=%3d" % (
+        value & 0xFF,
+        repr(chr(opcode)) if 0x20 < opcode < 0x7F else opcode,
+        (value >> 16) & 0x1F,
+        (value >> 24) & 0xFF,
+    )
+    if with_state:
+        state = (value >> 21) & 0x7
+        text += " state=" + (_state_names[state] if state < len(_state_names) else "Invalid")
+    return text
+
+
+class RetireMonitor(Monitor):
+    """
+    Reports the la_data_out word every time the spell core leaves the Execute state.
+
+    The monitor wakes up on changes of la_data_out rather than on every clock,
+    and passes the packed word as-is, so consumers can compare plain ints.
+    """
+
+    def __init__(self, name, la_data_out, callback=None, event=None):
+        self.name = name
+        self.signal = la_data_out
+        self.retired = 0
+        Monitor.__init__(self, callback, event)
+
+    def _state_change(self, prev_state, value):
+        """Called with the new la_data_out word whenever the core changes state"""
+        if prev_state == STATE_EXECUTE:
+            self.retired += 1
+            self._recv(value)
+
+    async def _monitor_recv(self):
+        edge = Edge(self.signal)
+        readonly = ReadOnly()
+        prev_state = None
+        while True:
+            await edge
+            # Wait for every field of la_data_out to settle
+            await readonly
+            value = self.signal.value
+            if not value.is_resolvable:
+                continue
+            value = value.integer
+            state = (value >> 21) & 0x7
+            if state != prev_state:
+                self._state_change(prev_state, value)
+                prev_state = state
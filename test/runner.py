@@ -0,0 +1,182 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Runs the tests of a cocotb module in parallel simulator processes
+
+The compiled image is shared: every shard runs it with its own TESTCASE list in
+its own directory under sim_build/. The results.xml files of all shards are
+merged into one report, and the wall time of every test is printed. Shards are
+balanced with the wall times recorded in the previous report, if there is one.
+
+With --coverage, every shard records functional coverage (see
+test/coverage.py), and the shards are merged into one coverage file.
+
+Waveforms are off (see test/waveform.py). With --trace-failures, every failed
+test is run again on its own with a full FST dump, <test>.fst in its directory.
+
+Usage::
+
+    python -m test.runner --variant rtl --module test.test_spell
+"""
+
+import argparse
+import ast
+import heapq
+import importlib.util
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from test.coverage import Coverage
+from test.perf import append_history, make_records
+from test.sim import BUILD_DIR, VARIANTS, build_variant, read_results, start_vvp
+
+
+def discover_tests(module):
+    """Lists the @cocotb.test() coroutines of a module, without importing it"""
+    path = importlib.util.find_spec(module).origin
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    names = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for decorator in node.decorator_list:
+            target = decorator.func if isinstance(decorator, ast.Call) else decorator
+            if isinstance(target, ast.Attribute) and target.attr == "test":
+                if node.name not in names:
+                    names.append(node.name)
+    return names
+
+
+def make_shards(tests, count, durations):
+    """Splits tests into `count` shards of similar total duration, longest first"""
+    shards = [(0.0, index, []) for index in range(min(count, len(tests)))]
+    heapq.heapify(shards)
+    default = max(durations.values(), default=1.0)
+    for test in sorted(tests, key=lambda name: -durations.get(name, default)):
+        total, index, names = heapq.heappop(shards)
+        names.append(test)
+        heapq.heappush(shards, (total + durations.get(test, default), index, names))
+    return [names for _, _, names in sorted(shards, key=lambda shard: shard[1])]
+
+
+def merge_results(results, path):
+    testsuites = ET.Element("testsuites", name="results")
+    testsuite = ET.SubElement(testsuites, "testsuite", name="all", package="all")
+    for shard_results in results:
+        for testcase in shard_results:
+            testsuite.append(testcase)
+    ET.ElementTree(testsuites).write(path, encoding="UTF-8", xml_declaration=True)
+
+
+def run_shards(image, module, shards, workdir, jobs, extra_env=None, plusargs=()):
+    """
+    Runs every shard (a list of test names) in its own vvp process, at most `jobs`
+    at a time. Returns a list of (shard directory, return code) in shard order.
+    """
+    pending = list(enumerate(shards))
+    running = {}
+    finished = {}
+    while pending or running:
+        while pending and len(running) < jobs:
+            index, names = pending.pop(0)
+            shard_dir = os.path.join(workdir, "shard%d" % index)
+            for output in ("results.xml", "coverage.json", "perf.json"):
+                if os.path.exists(os.path.join(shard_dir, output)):
+                    os.remove(os.path.join(shard_dir, output))
+            process = start_vvp(
+                image, module, shard_dir, ",".join(names), extra_env, plusargs
+            )
+            running[index] = (shard_dir, process)
+        for index, (shard_dir, process) in list(running.items()):
+            if process.poll() is not None:
+                finished[index] = (shard_dir, process.returncode)
+                del running[index]
+        time.sleep(0.05)
+    return [finished[index] for index in range(len(shards))]
+
+
+def trace_failures(image, module, names, workdir, jobs):
+    """Reruns each test in `names` alone, dumping all of its waveforms"""
+    trace_dir = os.path.join(workdir, "trace")
+    for name in names:
+        plusargs = ["-fst", "+dump", "+dump_on", "+dumpfile=%s.fst" % name]
+        shard_dir, _ = run_shards(
+            image, module, [[name]], os.path.join(trace_dir, name), jobs, plusargs=plusargs
+        )[0]
+        print("  TRACE %s: %s" % (name, os.path.join(shard_dir, "%s.fst" % name)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run cocotb tests in parallel")
+    parser.add_argument("--variant", default="rtl", choices=sorted(VARIANTS))
+    parser.add_argument("--image", default=None, help="use this image instead of building --variant")
+    parser.add_argument("--module", default="test.test_spell")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--shards", type=int, default=None, help="default: one per test")
+    parser.add_argument("--results", default="results.xml", help="merged report")
+    parser.add_argument(
+        "--trace-failures", action="store_true", help="rerun failed tests with an FST dump"
+    )
+    parser.add_argument("--coverage", default=None, help="record merged functional coverage here")
+    parser.add_argument(
+        "--history", default="perf_history.jsonl", help="per-test performance history, '' to skip"
+    )
+    parser.add_argument("tests", nargs="*", help="default: all tests in the module")
+    args = parser.parse_args()
+
+    tests = args.tests or discover_tests(args.module)
+    durations = {name: wall for name, _, wall, _ in read_results(args.results)}
+    shards = make_shards(tests, args.shards or len(tests), durations)
+    image = args.image or build_variant(args.variant)
+    workdir = os.path.join(BUILD_DIR, "runner", args.variant)
+
+    print("Running %d tests in %d shards on %d jobs" % (len(tests), len(shards), args.jobs))
+    start = time.perf_counter()
+    env = {"SPELL_COVERAGE": "coverage.json"} if args.coverage else None
+    finished = run_shards(image, args.module, shards, workdir, args.jobs, env)
+    elapsed = time.perf_counter() - start
+
+    report = []
+    failed = []
+    for names, (shard_dir, _) in zip(shards, finished):
+        results_file = os.path.join(shard_dir, "results.xml")
+        if os.path.exists(results_file):
+            report.append(ET.parse(results_file).iter("testcase"))
+        results = {name: (passed, wall) for name, passed, wall, _ in read_results(results_file)}
+        for name in names:
+            # Tests missing from the report count as failed, e.g. if the simulator crashed
+            passed, wall = results.get(name, (False, 0.0))
+            if not passed:
+                failed.append((name, os.path.join(shard_dir, "sim.log")))
+            print("%-4s %-32s %8.2f s" % ("PASS" if passed else "FAIL", name, wall))
+    merge_results(report, args.results)
+
+    if args.coverage:
+        paths = [os.path.join(shard_dir, "coverage.json") for shard_dir, _ in finished]
+        coverage = Coverage.load([path for path in paths if os.path.exists(path)])
+        coverage.save(args.coverage)
+        print(coverage.report())
+
+    if args.history:
+        shard_dirs = [shard_dir for shard_dir, _ in finished]
+        records = make_records(
+            [os.path.join(shard_dir, "results.xml") for shard_dir in shard_dirs],
+            [os.path.join(shard_dir, "perf.json") for shard_dir in shard_dirs],
+            args.variant,
+        )
+        append_history(records, args.history)
+
+    print("%d tests, %d failed, %.1f s wall time" % (len(tests), len(failed), elapsed))
+    for name, log in failed:
+        print("  FAIL %s: see %s" % (name, log))
+    if args.trace_failures and failed:
+        trace_failures(image, args.module, [name for name, _ in failed], workdir, args.jobs)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
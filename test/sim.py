@@ -0,0 +1,286 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Helpers for building the testbench and running it in simulator processes
+
+Compiled images are cached under sim_build/images/, keyed by a hash of the
+source contents, top modules, defines, include paths and the simulator version,
+so unchanged variants are never elaborated twice. Build or run a variant with::
+
+    python -m test.sim build rtl              # prints the path of the image
+    python -m test.sim run rtl test.test_spell
+
+Variants run on Icarus Verilog, except the verilator* ones, which are compiled
+to a native executable with Verilator. Verilator builds a single top module,
+so they don't include the `dump` module of test/dump_spell.v: verilator_trace
+is built with --trace-fst instead and dumps the whole run to dump.fst. To time
+the test suite on two variants::
+
+    python -m test.sim compare rtl verilator test.test_spell
+
+Each parallel process gets its own working directory, so that waveform dumps
+and results.xml files of concurrent runs don't clobber each other.
+"""
+
+import argparse
+import functools
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUILD_DIR = os.path.join(REPO_ROOT, "sim_build")
+IMAGE_DIR = os.path.join(BUILD_DIR, "images")
+
+RTL_SOURCES = ["src/spell.v", "src/mem.v", "src/mem_dff.v", "src/mem_io.v", "src/execute.v"]
+GL_SOURCES = ["gl/spell.lvs.powered.v"]
+
+
+def _pdk_include():
+    return os.path.join(os.environ.get("PDK_ROOT", ""), "sky130A")
+
+
+ICARUS = "icarus"
+VERILATOR = "verilator"
+
+# Image file name by simulator, which is how start_vvp tells images apart
+IMAGE_NAMES = {ICARUS: "spell.out", VERILATOR: "Vspell"}
+
+# name: (simulator, sources, top modules, defines, include paths, extra flags)
+# fmt: off
+VARIANTS = {
+    "rtl": (ICARUS, RTL_SOURCES + ["test/dump_spell.v"], ["spell", "dump"], ["SPELL_DFF_DELAY"], ["src"], []),
+    "rtl_nodelay": (ICARUS, RTL_SOURCES + ["test/dump_spell.v"], ["spell", "dump"], [], ["src"], []),
+    "rtl_nodump": (ICARUS, RTL_SOURCES, ["spell"], ["SPELL_DFF_DELAY"], ["src"], []),
+    "gl": (ICARUS, GL_SOURCES + ["test/dump_spell.v"], ["spell", "dump"], [], [_pdk_include], ["-g2012"]),
+    "gl_nodump": (ICARUS, GL_SOURCES, ["spell"], [], [_pdk_include], ["-g2012"]),
+    "verilator": (VERILATOR, RTL_SOURCES, ["spell"], ["SPELL_DFF_DELAY"], ["src"], []),
+    "verilator_trace": (VERILATOR, RTL_SOURCES, ["spell"], ["SPELL_DFF_DELAY"], ["src"], ["--trace-fst"]),
+}
+# fmt: on
+
+
+@functools.lru_cache(maxsize=None)
+def simulator_version(simulator):
+    command = ["iverilog", "-V"] if simulator == ICARUS else ["verilator", "--version"]
+    result = subprocess.run(command, capture_output=True, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else ""
+
+
+def image_key(sources, tops, defines, includes, flags, simulator=ICARUS):
+    digest = hashlib.sha256()
+    digest.update(simulator_version(simulator).encode())
+    digest.update(repr((list(tops), list(defines), list(includes), list(flags))).encode())
+    for source in sources:
+        digest.update(source.encode())
+        with open(os.path.join(REPO_ROOT, source), "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()[:20]
+
+
+def build_image(sources, tops, defines=(), includes=(), flags=(), simulator=ICARUS):
+    """
+    Compiles the sources with iverilog or Verilator, unless an image built from
+    identical inputs is already cached. Returns the path of the image.
+    """
+    key = image_key(sources, tops, defines, includes, flags, simulator)
+    image_dir = os.path.join(IMAGE_DIR, key)
+    image = os.path.join(image_dir, IMAGE_NAMES[simulator])
+    if os.path.exists(image):
+        return image
+
+    os.makedirs(image_dir, exist_ok=True)
+    # Build under a unique name and rename, so concurrent builds can't see a partial image
+    partial = "%s.%d" % (image, os.getpid())
+    if simulator == VERILATOR:
+        command = _verilator_build(partial, sources, tops, defines, includes, flags)
+    else:
+        command = ["iverilog", "-o", partial]
+        command += ["-s%s" % top for top in tops]
+        command += ["-D%s" % define for define in defines]
+        command += ["-I%s" % include for include in includes]
+        command += list(flags) + list(sources)
+        # Keep stdout clean for `python -m test.sim build`
+        subprocess.run(command, cwd=REPO_ROOT, check=True, stdout=sys.stderr)
+    os.replace(partial, image)
+    with open(os.path.join(image_dir, "command.txt"), "w") as f:
+        f.write(" ".join(image if arg == partial else arg for arg in command) + "\n")
+    return image
+
+
+def _verilator_build(output, sources, tops, defines, includes, flags):
+    """
+    Builds a Verilator executable with the cocotb VPI library linked in, like
+    cocotb's Makefile.verilator. Returns the verilator command.
+    """
+    (top,) = tops
+    obj_dir = "%s.obj" % output
+    libs = os.path.join(cocotb_config("--prefix"), "cocotb", "libs")
+    ldflags = "-Wl,-rpath,{0} -L{0} -lcocotbvpi_verilator -lgpi -lcocotb -lgpilog -lcocotbutils"
+    ldflags = ldflags.format(libs)
+    command = ["verilator", "-cc", "--exe", "--vpi", "--public-flat-rw", "-Wno-fatal"]
+    command += ["--Mdir", obj_dir, "--top-module", top, "--prefix", "Vtop", "-o", "Vtop"]
+    command += ["-DCOCOTB_SIM=1", "-LDFLAGS", ldflags]
+    command += ["-D%s" % define for define in defines]
+    command += ["-I%s" % include for include in includes]
+    command += list(flags)
+    command += [os.path.join(cocotb_config("--share"), "lib", "verilator", "verilator.cpp")]
+    command += list(sources)
+    subprocess.run(command, cwd=REPO_ROOT, check=True, stdout=sys.stderr)
+    jobs = "-j%d" % (os.cpu_count() or 1)
+    subprocess.run(["make", jobs, "-C", obj_dir, "-f", "Vtop.mk"], check=True, stdout=sys.stderr)
+    os.replace(os.path.join(obj_dir, "Vtop"), output)
+    shutil.rmtree(obj_dir)
+    return command
+
+
+def build_variant(name):
+    simulator, sources, tops, defines, includes, flags = VARIANTS[name]
+    includes = [include() if callable(include) else include for include in includes]
+    return build_image(sources, tops, defines, includes, flags, simulator)
+
+
+def image_simulator(image):
+    return VERILATOR if os.path.basename(image) == IMAGE_NAMES[VERILATOR] else ICARUS
+
+
+@functools.lru_cache(maxsize=None)
+def cocotb_config(flag):
+    return subprocess.check_output(["cocotb-config", flag], text=True).strip()
+
+
+def vvp_command(image, plusargs=()):
+    if image_simulator(image) == VERILATOR:
+        return [os.path.abspath(image)] + list(plusargs)
+    libs = os.path.join(cocotb_config("--prefix"), "cocotb", "libs")
+    return ["vvp", "-M", libs, "-m", "libcocotbvpi_icarus", os.path.abspath(image)] + list(plusargs)
+
+
+def sim_env(module, testcase=None, extra_env=None):
+    env = dict(os.environ)
+    env["MODULE"] = module
+    env["TOPLEVEL"] = "spell"
+    env["TOPLEVEL_LANG"] = "verilog"
+    env.pop("TESTCASE", None)
+    if testcase:
+        env["TESTCASE"] = testcase
+    env.setdefault("COCOTB_REDUCED_LOG_FMT", "1")
+    env.setdefault("LIBPYTHON_LOC", cocotb_config("--libpython"))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    if extra_env:
+        env.update(extra_env)
+    return env
+
+
+def start_vvp(image, module, workdir, testcase=None, extra_env=None, plusargs=()):
+    """
+    Starts a simulator process running `module` in `workdir`. Output goes to sim.log
+    and test results to results.xml in that directory.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    log = open(os.path.join(workdir, "sim.log"), "w")
+    try:
+        return subprocess.Popen(
+            vvp_command(image, plusargs),
+            cwd=workdir,
+            env=sim_env(module, testcase, extra_env),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    finally:
+        log.close()
+
+
+def run_vvp(image, module, testcase=None, extra_env=None, plusargs=()):
+    """Runs a simulation in the current directory, replacing this process"""
+    command = vvp_command(image, plusargs)
+    os.execvpe(command[0], command, sim_env(module, testcase, extra_env))
+
+
+def read_results(path):
+    """
+    Returns a list of (name, passed, wall time in seconds, sim time in ns) from a
+    cocotb results.xml file, or an empty list if the file doesn't exist.
+    """
+    if not os.path.exists(path):
+        return []
+    results = []
+    for testcase in ET.parse(path).iter("testcase"):
+        passed = testcase.find("failure") is None and testcase.find("error") is None
+        results.append(
+            (
+                testcase.get("name"),
+                passed,
+                float(testcase.get("time", 0)),
+                float(testcase.get("sim_time_ns", 0)),
+            )
+        )
+    return results
+
+
+def compare(baseline, variant, module):
+    """
+    Runs `module` on both variants, one after the other, and prints the wall time
+    of every test and of each whole run. Builds are not timed.
+    """
+    runs = []
+    for name in (baseline, variant):
+        image = build_variant(name)
+        workdir = os.path.join(BUILD_DIR, "compare", name)
+        start = time.perf_counter()
+        process = start_vvp(image, module, workdir)
+        process.wait()
+        elapsed = time.perf_counter() - start
+        results = read_results(os.path.join(workdir, "results.xml"))
+        results = {test: (passed, wall) for test, passed, wall, _ in results}
+        runs.append((name, workdir, process.returncode, elapsed, results))
+
+    (_, _, _, base_elapsed, base_results), (_, _, _, elapsed, results) = runs
+    row = "%-32s %9.2fs %9.2fs %7.1fx"
+    print("%-32s %10s %10s %8s" % ("test", baseline, variant, "speedup"))
+    for test, (_, base_wall) in base_results.items():
+        wall = results.get(test, (False, 0.0))[1]
+        print(row % (test, base_wall, wall, base_wall / wall if wall else 0.0))
+    print(row % ("total", base_elapsed, elapsed, base_elapsed / elapsed))
+    failed = False
+    for name, workdir, returncode, _, results in runs:
+        failing = [test for test, (passed, _) in results.items() if not passed]
+        if returncode or not results or failing:
+            failed = True
+            log = os.path.join(workdir, "sim.log")
+            print("FAIL: %s %s (see %s)" % (name, " ".join(failing), log))
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and run cached simulation images")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build a variant, print its image path")
+    build_parser.add_argument("variant", choices=sorted(VARIANTS))
+    run_parser = subparsers.add_parser("run", help="build a variant and run a cocotb module on it")
+    run_parser.add_argument("variant", choices=sorted(VARIANTS))
+    run_parser.add_argument("module")
+    run_parser.add_argument("--testcase", default=None)
+    run_parser.add_argument("plusargs", nargs="*")
+    compare_parser = subparsers.add_parser("compare", help="time a cocotb module on two variants")
+    compare_parser.add_argument("baseline", choices=sorted(VARIANTS))
+    compare_parser.add_argument("variant", choices=sorted(VARIANTS))
+    compare_parser.add_argument("module")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        return compare(args.baseline, args.variant, args.module)
+    image = build_variant(args.variant)
+    if args.command == "build":
+        print(image)
+    else:
+        run_vvp(image, args.module, args.testcase, plusargs=args.plusargs)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Text assembler for SPELL programs
+
+The output is a list of code bytes, ready for ``SpellController.write_program``
+or ``load_code``::
+
+    code = assemble('''
+        .equ COUNT 10
+        .macro inc
+            1 +
+        .endm
+
+            0 COUNT         ; sum, counter
+        loop:
+            x inc x @loop   ; loop to `loop` while the counter is not zero
+            z
+    ''')
+
+Syntax, one or more tokens per line, ``;`` starts a comment:
+
+* opcodes are written as their character: ``+ - & ^ | > < = @ , ! ? r w x z``.
+  ``dup`` is the ``2`` opcode and ``stop`` is 0xFF, since ``2`` is the number 2,
+* numbers (``42``, ``0x2a``, ``0b101010``), characters (``'a'``) and constants
+  push a literal. Literals that would be decoded as an opcode are rejected,
+* ``name:`` defines a label, ``name`` pushes its address, and ``@name``,
+  ``=name``, ``?name`` and ``!name`` push it and execute the opcode,
+* ``.equ NAME value`` defines a constant,
+* ``.macro NAME [PARAM...]`` ... ``.endm`` defines a macro. ``NAME arg...``
+  expands it, replacing each parameter with the next token, also in ``@PARAM``
+  style references and ``PARAM:`` label definitions. Labels defined in
+  a macro body are local to each expansion,
+* ``.org ADDR`` continues at ADDR, padding with zeros, and ``.byte V...``
+  emits raw bytes (e.g. data read with ``?``) without the literal check.
+
+With ``optimize=True``, `peephole` rewrites the program before labels are
+resolved. Every rule removes code bytes without adding executed instructions,
+so the result is never slower: each byte saved is a full Fetch through
+spell_mem. Code moves, so programs that jump to or address their own code
+(``=``, ``@``, ``?`` or ``!``) with anything but a label are left as they are.
+"""
+
+import re
+
+from test.spell_model import OPCODES
+
+_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*$")
+_OPERATORS = "+-&^|><=@,!?rwxz"
+_ALIASES = {"dup": ord("2"), "stop": 0xFF}
+_REF_OPCODES = "=@?!"
+_MACRO_DEPTH = 16
+
+# Folding of literal operands: opcode: (number of operands, function)
+_FOLD = {
+    ord("+"): (2, lambda a, b: a + b),
+    ord("-"): (2, lambda a, b: a - b),
+    ord("&"): (2, lambda a, b: a & b),
+    ord("|"): (2, lambda a, b: a | b),
+    ord("^"): (2, lambda a, b: a ^ b),
+    ord("<"): (1, lambda a: a << 1),
+    ord(">"): (1, lambda a: a >> 1),
+}
+
+# Program items, as (kind, value, line)
+OP = "op"  # opcode byte
+LIT = "lit"  # literal push
+REF = "ref"  # push of a label address
+LABEL = "label"
+BYTE = "byte"  # raw byte
+ORG = "org"
+
+
+class AssemblerError(Exception):
+    def __init__(self, message, line=None):
+        if line is not None:
+            message = "line %d: %s" % (line, message)
+        Exception.__init__(self, message)
+
+
+def is_literal(value):
+    """True if the core pushes `value` as a literal instead of executing it"""
+    return value not in OPCODES
+
+
+def _check_literal(value, line):
+    if not 0 <= value <= 0xFF:
+        raise AssemblerError("literal %d out of range" % value, line)
+    if not is_literal(value):
+        raise AssemblerError("literal %d is the opcode %r" % (value, chr(value)), line)
+    return value
+
+
+def _tokenize(source):
+    for line, text in enumerate(source.splitlines(), 1):
+        for token in text.split(";", 1)[0].split():
+            yield token, line
+
+
+def _substitute(token, values):
+    """Replaces a macro parameter in `token`, alone or as a label reference or definition"""
+    if token in values:
+        return values[token]
+    if len(token) > 1 and token[0] in _REF_OPCODES and token[1:] in values:
+        return token[0] + values[token[1:]]
+    if token.endswith(":") and token[:-1] in values:
+        return values[token[:-1]] + ":"
+    return token
+
+
+class _Parser:
+    def __init__(self):
+        self.constants = {}
+        self.macros = {}
+        self.items = []
+        self.expansions = 0
+
+    def number(self, token, line):
+        if token in self.constants:
+            return self.constants[token]
+        if len(token) == 3 and token[0] == token[2] == "'":
+            return ord(token[1])
+        try:
+            return int(token, 0)
+        except ValueError:
+            raise AssemblerError("expected a number, got %r" % token, line) from None
+
+    def parse(self, tokens, depth=0):
+        """Parses a list of (token, line) pairs"""
+        index = 0
+        while index < len(tokens):
+            token, line = tokens[index]
+            index += 1
+            # Arguments of directives are the remaining tokens on the same line
+            args = []
+            while index < len(tokens) and tokens[index][1] == line and token.startswith("."):
+                args.append(tokens[index][0])
+                index += 1
+            if token == ".equ":
+                if len(args) != 2:
+                    raise AssemblerError(".equ needs a name and a value", line)
+                self.constants[self.name(args[0], line)] = self.number(args[1], line)
+            elif token == ".macro":
+                if not args:
+                    raise AssemblerError(".macro needs a name", line)
+                name = self.name(args[0], line)
+                body = []
+                while index < len(tokens) and tokens[index][0] != ".endm":
+                    body.append(tokens[index])
+                    index += 1
+                if index == len(tokens):
+                    raise AssemblerError("missing .endm for macro %s" % name, line)
+                index += 1
+                self.macros[name] = (args[1:], body)
+            elif token == ".org":
+                if len(args) != 1:
+                    raise AssemblerError(".org needs an address", line)
+                self.items.append((ORG, self.number(args[0], line), line))
+            elif token == ".byte":
+                for arg in args:
+                    self.items.append((BYTE, self.number(arg, line) & 0xFF, line))
+            elif token.startswith("."):
+                raise AssemblerError("unknown directive %s" % token, line)
+            elif token in self.macros:
+                if depth >= _MACRO_DEPTH:
+                    raise AssemblerError("macro %s nested too deeply" % token, line)
+                params, body = self.macros[token]
+                if index + len(params) > len(tokens):
+                    raise AssemblerError("macro %s needs %d arguments" % (token, len(params)), line)
+                values = dict(zip(params, (arg for arg, _ in tokens[index : index + len(params)])))
+                index += len(params)
+                body = self.localize(token, body, params)
+                body = [(_substitute(item, values), body_line) for item, body_line in body]
+                try:
+                    self.parse(body, depth + 1)
+                except AssemblerError as error:
+                    raise AssemblerError(
+                        "%s (in macro %s used at line %d)" % (error, token, line)
+                    ) from None
+            else:
+                self.item(token, line)
+
+    def localize(self, macro, body, params):
+        """
+        Renames the labels defined in a macro body, and their uses, for one
+        expansion. Labels named by a parameter belong to the caller.
+        """
+        self.expansions += 1
+        local = {item[:-1] for item, _ in body if item.endswith(":")} - set(params)
+        if not local:
+            return body
+
+        def rename(name):
+            return "%s.%s.%d" % (macro, name, self.expansions) if name in local else name
+
+        tokens = []
+        for item, line in body:
+            if item.endswith(":"):
+                item = rename(item[:-1]) + ":"
+            elif item[0] in _REF_OPCODES and len(item) > 1:
+                item = item[0] + rename(item[1:])
+            else:
+                item = rename(item)
+            tokens.append((item, line))
+        return tokens
+
+    def name(self, token, line):
+        if not _NAME.match(token) or token in _OPERATORS or token in _ALIASES:
+            raise AssemblerError("invalid name %r" % token, line)
+        return token
+
+    def item(self, token, line):
+        items = self.items
+        if len(token) == 1 and token in _OPERATORS:
+            items.append((OP, ord(token), line))
+        elif token in _ALIASES:
+            items.append((OP, _ALIASES[token], line))
+        elif token.endswith(":"):
+            items.append((LABEL, self.name(token[:-1], line), line))
+        elif token[0] in _REF_OPCODES and len(token) > 1:
+            self.item(self.name(token[1:], line) if _NAME.match(token[1:]) else token[1:], line)
+            items.append((OP, ord(token[0]), line))
+        elif _NAME.match(token) and token not in self.constants:
+            items.append((REF, token, line))
+        else:
+            items.append((LIT, _check_literal(self.number(token, line), line), line))
+
+
+def parse(source):
+    """Parses assembly source into a list of (kind, value, line) items"""
+    parser = _Parser()
+    parser.parse(list(_tokenize(source)))
+    return parser.items
+
+
+def _fold(items, index):
+    """Returns (length, replacement) for a foldable literal operation at `index`"""
+    kind, value, line = items[index]
+    if kind != OP or value not in _FOLD:
+        return None
+    operands, function = _FOLD[value]
+    start = index - operands
+    if start < 0 or any(item[0] != LIT for item in items[start:index]):
+        return None
+    result = function(*(item[1] for item in items[start:index])) & 0xFF
+    if not is_literal(result):
+        return None
+    return operands + 1, [(LIT, result, line)]
+
+
+def peephole(items):
+    """
+    Applies peephole rules until none matches. Labels split the windows, so code
+    that is jumped into is never merged with the code before it:
+
+    * ``x x`` is removed,
+    * arithmetic, logic and shifts on literal operands are folded into one literal,
+      unless the result is an opcode byte,
+    * ``a b x`` on two literals becomes ``b a``,
+    * ``0 <target> @`` is removed: with a zero counter, '@' only drops both,
+    * ``<label> =`` right before that label is removed.
+
+    Programs with a jump or code access whose address is not a label are returned
+    unchanged, as the rules move code.
+    """
+    items = list(items)
+    for index, (kind, value, _) in enumerate(items):
+        if kind == OP and chr(value) in _REF_OPCODES and (index == 0 or items[index - 1][0] != REF):
+            return items
+    changed = True
+    while changed:
+        changed = False
+        index = 0
+        while index < len(items):
+            replacement = _rewrite(items, index)
+            if replacement is None:
+                index += 1
+                continue
+            length, new_items = replacement
+            items[index - length + 1 : index + 1] = new_items
+            index = max(index - length + 1, 0)
+            changed = True
+    return items
+
+
+def _rewrite(items, index):
+    """Returns (length, replacement) for a pattern ending at `index`, or None"""
+    kind, value, line = items[index]
+    if kind != OP:
+        return None
+    previous = [item[0:2] for item in items[max(index - 2, 0) : index]]
+    if value == ord("x"):
+        if previous[-1:] == [(OP, ord("x"))]:
+            return 2, []
+        if len(previous) == 2 and previous[0][0] == previous[1][0] == LIT:
+            (_, a), (_, b) = previous
+            return 3, [(LIT, b, line), (LIT, a, line)]
+        return None
+    if value == ord("@"):
+        if len(previous) == 2 and previous[0] == (LIT, 0) and previous[1][0] in (LIT, REF):
+            return 3, []
+        return None
+    if value == ord("="):
+        if previous[-1:] and previous[-1][0] == REF and index + 1 < len(items):
+            target = previous[-1][1]
+            for item in items[index + 1 :]:
+                if item[0] != LABEL:
+                    break
+                if item[1] == target:
+                    return 2, []
+        return None
+    return _fold(items, index)
+
+
+def link(items, code_size=256):
+    """Lays out the items and resolves label references. Returns (code, labels)."""
+    labels = {}
+    addr = 0
+    for kind, value, line in items:
+        if kind == LABEL:
+            if value in labels:
+                raise AssemblerError("label %s defined twice" % value, line)
+            labels[value] = addr
+        elif kind == ORG:
+            if value < addr:
+                raise AssemblerError(".org %d is behind the current address %d" % (value, addr), line)
+            addr = value
+        else:
+            addr += 1
+    if addr > code_size:
+        raise AssemblerError("program is %d bytes, code memory holds %d" % (addr, code_size))
+
+    code = []
+    for kind, value, line in items:
+        if kind == ORG:
+            code += [0] * (value - len(code))
+        elif kind == REF:
+            if value not in labels:
+                raise AssemblerError("undefined label or constant %s" % value, line)
+            address = labels[value]
+            if not is_literal(address):
+                raise AssemblerError(
+                    "address %d of label %s is the opcode %r" % (address, value, chr(address)), line
+                )
+            code.append(address)
+        elif kind != LABEL:
+            code.append(value)
+    return code, labels
+
+
+def assemble(source, optimize=False, code_size=256):
+    """Assembles source text into a list of code bytes"""
+    items = parse(source)
+    if optimize:
+        items = peephole(items)
+    return link(items, code_size)[0]
@@ -0,0 +1,241 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Pure-Python reference model of the SPELL core
+
+Mirrors the opcode semantics of ``spell_execute`` (src/execute.v) and the
+address decoding of ``spell_mem``, without modelling clock cycles. Use it as a
+golden model to precompute what a program should leave behind::
+
+    model = SpellModel()
+    model.load_code([66, 55, "-", "z"])
+    model.run()
+    assert model.sp == 1 and model.top == 11
+
+By default the memory sizes match ``spell_mem_dff`` (32 bytes of code, 8 bytes
+of data). Pass ``code_size=256, data_size=256`` to model the Wishbone SRAM.
+"""
+
+OPCODES = b"+-&^|><=@,2!?rwxz\xff"
+
+HALT_SLEEP = "sleep"
+HALT_STOP = "stop"
+
+REG_PIN = 0x36
+REG_DDR = 0x37
+REG_PORT = 0x38
+
+IO_START = 0x20
+IO_END = 0x60
+
+# True for every byte that is pushed to the stack as a literal
+_LITERAL = tuple(b not in OPCODES for b in range(256))
+
+
+def to_opcode(value):
+    if type(value) == str:
+        return ord(value)
+    return value
+
+
+class SpellModel:
+    def __init__(self, code_size=32, data_size=8):
+        self.code_size = code_size
+        self.data_size = data_size
+        # Both arrays cover the full 8-bit address space, so out-of-range
+        # reads come back as zero without a bounds check (writes are dropped).
+        self.code = bytearray(256)
+        self.data = bytearray(256)
+        self.stack = bytearray(32)
+        # GPIO registers: PIN (io_in), DDR (~io_oeb), PORT (io_out)
+        self.io = bytearray(3)
+        self.reset()
+
+    def reset(self):
+        self.pc = 0
+        self.sp = 0
+        self.opcode = 0
+        self.halted = HALT_SLEEP
+        self.delay_ms = 0
+        self.cycles_per_ms = 10000
+        self.retired = 0
+        # Retired instructions per opcode byte, and 'r'/'w' accesses to the IO registers
+        self.op_counts = [0] * 256
+        self.io_reads = 0
+        self.io_writes = 0
+        self.code[:] = bytes(256)
+        self.data[:] = bytes(256)
+        self.stack[:] = bytes(32)
+        self.io[:] = bytes(3)
+
+    @property
+    def top(self):
+        return self.stack[(self.sp - 1) & 0x1F]
+
+    @property
+    def io_in(self):
+        return self.io[0]
+
+    @io_in.setter
+    def io_in(self, value):
+        self.io[0] = value
+
+    @property
+    def io_oeb(self):
+        return ~self.io[1] & 0xFF
+
+    @property
+    def io_out(self):
+        return self.io[2]
+
+    def pack(self):
+        """
+        Returns the state in the ``la_data_out`` layout, with the state bits cleared.
+        """
+        return (self.top << 24) | (self.sp << 16) | (self.opcode << 8) | self.pc
+
+    def push(self, value):
+        self.stack[self.sp] = value
+        self.sp = (self.sp + 1) & 0x1F
+
+    def load_code(self, opcodes, offset=0):
+        for index, opcode in enumerate(opcodes):
+            addr = (offset + index) & 0xFF
+            if addr < self.code_size:
+                self.code[addr] = to_opcode(opcode)
+
+    def read_data(self, addr):
+        if IO_START <= addr < IO_END:
+            if addr == REG_PIN:
+                return self.io[0]
+            if addr == REG_DDR:
+                return self.io[1]
+            if addr == REG_PORT:
+                return self.io[2]
+            return 0
+        return self.data[addr]
+
+    def write_data(self, addr, value):
+        if IO_START <= addr < IO_END:
+            if addr == REG_PIN:
+                self.io[2] ^= value
+            elif addr == REG_DDR:
+                self.io[1] = value
+            elif addr == REG_PORT:
+                self.io[2] = value
+        elif addr < self.data_size:
+            self.data[addr] = value
+
+    def step(self):
+        """
+        Executes a single instruction from code memory.
+        """
+        return self.run(1)
+
+    def exec_opcode(self, opcode):
+        """
+        Executes `opcode` out of order, like a write to REG_EXEC: pc is not advanced.
+        """
+        return self._run(1, to_opcode(opcode))
+
+    def run(self, max_instructions=1_000_000):
+        """
+        Runs until the program sleeps ('z'), stops (0xFF) or `max_instructions`
+        have been executed. Returns the number of instructions executed.
+        """
+        return self._run(max_instructions, None)
+
+    def _run(self, count, injected):
+        code = self.code
+        stack = self.stack
+        literal = _LITERAL
+        code_size = self.code_size
+        counts = self.op_counts
+        pc = self.pc
+        sp = self.sp
+        op = self.opcode
+        halted = None
+        executed = 0
+        while executed < count:
+            executed += 1
+            if injected is None:
+                op = code[pc]
+                next_pc = (pc + 1) & 0xFF
+            else:
+                op = injected
+                next_pc = pc
+            counts[op] += 1
+            if literal[op]:
+                stack[sp] = op
+                sp = (sp + 1) & 0x1F
+                pc = next_pc
+                continue
+            t = (sp - 1) & 0x1F
+            b = (sp - 2) & 0x1F
+            if op == 0x78:  # x
+                stack[t], stack[b] = stack[b], stack[t]
+            elif op == 0x40:  # @
+                if stack[b]:
+                    next_pc = stack[t]
+                    stack[b] -= 1
+                    sp = t
+                else:
+                    sp = b
+            elif op == 0x2B:  # +
+                stack[b] = (stack[b] + stack[t]) & 0xFF
+                sp = t
+            elif op == 0x2D:  # -
+                stack[b] = (stack[b] - stack[t]) & 0xFF
+                sp = t
+            elif op == 0x72:  # r
+                if IO_START <= stack[t] < IO_END:
+                    self.io_reads += 1
+                stack[t] = self.read_data(stack[t])
+            elif op == 0x77:  # w
+                if IO_START <= stack[t] < IO_END:
+                    self.io_writes += 1
+                self.write_data(stack[t], stack[b])
+                sp = (sp - 2) & 0x1F
+            elif op == 0x32:  # 2
+                stack[sp] = stack[t]
+                sp = (sp + 1) & 0x1F
+            elif op == 0x3F:  # ?
+                stack[t] = code[stack[t]]
+            elif op == 0x21:  # !
+                if stack[t] < code_size:
+                    code[stack[t]] = stack[b]
+                sp = (sp - 2) & 0x1F
+            elif op == 0x26:  # &
+                stack[b] &= stack[t]
+                sp = t
+            elif op == 0x7C:  # |
+                stack[b] |= stack[t]
+                sp = t
+            elif op == 0x5E:  # ^
+                stack[b] ^= stack[t]
+                sp = t
+            elif op == 0x3E:  # >
+                stack[t] >>= 1
+            elif op == 0x3C:  # <
+                stack[t] = (stack[t] << 1) & 0xFF
+            elif op == 0x3D:  # =
+                next_pc = stack[t]
+                sp = t
+            elif op == 0x2C:  # ,
+                if self.cycles_per_ms:
+                    self.delay_ms += stack[t]
+                sp = t
+            elif op == 0x7A:  # z
+                halted = HALT_SLEEP
+            else:  # 0xFF
+                halted = HALT_STOP
+            pc = next_pc
+            if halted:
+                break
+        self.pc = pc
+        self.sp = sp
+        self.opcode = op
+        self.halted = halted
+        self.retired += executed
+        return executed
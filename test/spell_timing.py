@@ -0,0 +1,117 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Cycle estimator for SPELL programs, without running a simulator
+
+Models the state machine of ``spell`` (src/spell.v). Every instruction is a
+Fetch, an optional FetchDat ('?' and 'r'), one Execute cycle, an optional
+Store ('!' and 'w') and an optional Delay (',' when cycles_per_ms is set)::
+
+    Fetch, FetchDat, Store   3 cycles + memory latency
+    Execute                  1 cycle
+    Delay                    milliseconds * cycles_per_ms
+
+A memory access takes 3 cycles when data_ready comes back right away: one to
+raise mem_select, one for the memory to answer, one for the core to see
+data_ready. `spell_mem_dff` built with SPELL_DFF_DELAY adds DFF_DELAY_CYCLES,
+the Wishbone SRAM adds its ack latency, and the GPIO registers (data addresses
+0x20-0x5F) never add any.
+
+Dynamic estimates run the reference model and count what it executed::
+
+    timing = CycleModel(dff_delay=DFF_DELAY_CYCLES)
+    model = SpellModel()
+    model.load_code(program)
+    model.run()
+    timing.model_cycles(model)  # {"Fetch": ..., "FetchDat": ..., ...}
+
+The per-state dicts have the same layout as ``TraceRecorder.state_cycles()``,
+so they can be compared with the RTL directly. The cycles from leaving Sleep
+until the program sleeps again, as returned by ``SpellController.run_until``,
+are their sum.
+"""
+
+from test.spell_model import IO_END, IO_START, SpellModel
+
+STATES = ["Fetch", "FetchDat", "Execute", "Store", "Delay"]
+
+# Wait cycles added to every spell_mem_dff access by SPELL_DFF_DELAY
+DFF_DELAY_CYCLES = 3
+
+_ACCESS_CYCLES = 3
+_DATA_READ_OPCODES = b"?r"
+_STORE_OPCODES = b"!w"
+_DATA_OPCODES = b"rw"
+
+
+class CycleModel:
+    def __init__(self, dff_delay=0, sram=False, sram_latency=0):
+        """
+        `dff_delay` and `sram_latency` are the wait cycles added to each memory
+        access by spell_mem_dff and by the Wishbone SRAM. `sram` selects the SRAM
+        for code and data, like CTRL_SRAM_ENABLE.
+        """
+        self.sram = sram
+        self.memory_latency = sram_latency if sram else dff_delay
+
+    def access_cycles(self, io=False):
+        return _ACCESS_CYCLES if io else _ACCESS_CYCLES + self.memory_latency
+
+    def instruction_cycles(self, opcode, addr=0, delay_ms=0, cycles_per_ms=0):
+        """
+        Returns the cycles per state for one instruction fetched from code memory.
+        `addr` is the data address of 'r' and 'w', `delay_ms` the argument of ','.
+        """
+        access = self.access_cycles(opcode in _DATA_OPCODES and IO_START <= addr < IO_END)
+        cycles = dict.fromkeys(STATES, 0)
+        cycles["Fetch"] = self.access_cycles()
+        cycles["Execute"] = 1
+        if opcode in _DATA_READ_OPCODES:
+            cycles["FetchDat"] = access
+        elif opcode in _STORE_OPCODES:
+            cycles["Store"] = access
+        elif opcode == ord(","):
+            cycles["Delay"] = delay_ms * cycles_per_ms
+        return cycles
+
+    def static_cycles(self, code, start=0):
+        """
+        Estimates straight-line code from `start` to the first 'z' or 0xFF, ignoring
+        jumps and delays and assuming that 'r' and 'w' don't touch the GPIO registers.
+        Returns the total number of cycles.
+        """
+        total = 0
+        for opcode in code[start:]:
+            total += sum(self.instruction_cycles(opcode).values())
+            if opcode in (ord("z"), 0xFF):
+                break
+        return total
+
+    def model_cycles(self, model):
+        """Returns the cycles per state of everything `model` executed since its reset"""
+        counts = model.op_counts
+        instructions = sum(counts)
+        reads = sum(counts[opcode] for opcode in _DATA_READ_OPCODES)
+        stores = sum(counts[opcode] for opcode in _STORE_OPCODES)
+        memory = self.access_cycles()
+        io = self.access_cycles(True)
+        return {
+            "Fetch": instructions * memory,
+            "FetchDat": (reads - model.io_reads) * memory + model.io_reads * io,
+            "Execute": instructions,
+            "Store": (stores - model.io_writes) * memory + model.io_writes * io,
+            "Delay": model.delay_ms * model.cycles_per_ms,
+        }
+
+    def estimate(self, code, cycles_per_ms=0, io_in=0, max_instructions=1_000_000):
+        """
+        Runs `code` on a fresh reference model sized for the selected memory.
+        Returns (cycles per state, model).
+        """
+        model = SpellModel(256, 256) if self.sram else SpellModel()
+        model.cycles_per_ms = cycles_per_ms
+        model.io_in = io_in
+        model.load_code(code)
+        model.run(max_instructions)
+        return self.model_cycles(model), model
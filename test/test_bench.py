@@ -0,0 +1,145 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+CPI benchmarks for the spell core. See test/bench.py for how to run them.
+
+SPELL_BENCH_CONFIG names the memory configuration in the results,
+SPELL_BENCH_MEMORY selects where code and data live ("dff" or "sram"), and
+results are written as JSON to SPELL_BENCH_OUTPUT (default: bench.json).
+"""
+
+import json
+import os
+import time
+
+import cocotb
+from test.spell_model import SpellModel
+from test.spell_timing import DFF_DELAY_CYCLES, CycleModel
+from test.test_spell import create_spell, make_clock, reg_cycles_per_ms, reset
+from test.trace import TraceRecorder
+
+BENCH_CONFIG = os.environ.get("SPELL_BENCH_CONFIG", "dff")
+BENCH_MEMORY = os.environ.get("SPELL_BENCH_MEMORY", "dff")
+BENCH_OUTPUT = os.environ.get("SPELL_BENCH_OUTPUT", "bench.json")
+
+CYCLES_PER_MS = 3
+
+# Expected timing of each configuration
+TIMING = {
+    "dff_delay": CycleModel(dff_delay=DFF_DELAY_CYCLES),
+    "dff": CycleModel(),
+    "sram": CycleModel(sram=True),
+}
+
+# name: (code, initial code bytes at 24)
+# fmt: off
+PROGRAMS = {
+    # The program from test_intg_multiply: 10 * 11 by repeated addition
+    "multiply": ([
+        10, 11,
+        1, 'w',
+        0, 'x',
+        'x', 1, 'r', '+',
+        'x', 6, '@',
+        1, 'r', '-',
+        'z',
+    ], []),
+    # Copies code bytes 24-27 to 28-31 with '?' and '!', keeping the index in data[0]
+    "memcpy": ([
+        3,
+        '2', 0, 'w',
+        '2', 24, '+', '?',
+        0, 'r', 28, '+', '!',
+        1, '@',
+        'z',
+    ], [11, 22, 33, 44]),
+    # Increments each of the 8 data bytes, 16 times
+    "rw_loop": ([
+        15,
+        7,
+        '2', '2', 'r', 1, '+', 'x', 'w',
+        2, '@',
+        1, '@',
+        'z',
+    ], []),
+    # Toggles io_out[0] through the PIN register
+    "gpio_toggle": ([
+        1, 0x37, 'w',
+        200,
+        1, 0x36, 'w',
+        4, '@',
+        'z',
+    ], []),
+}
+# fmt: on
+
+
+async def run_program(dut, spell, code, code_data, trace=False):
+    """Runs a program from reset. Returns (cycles, wall time in seconds, recorder)."""
+    await reset(dut)
+    await spell.wb_write(reg_cycles_per_ms, CYCLES_PER_MS)
+    await spell.load_code(code)
+    if code_data:
+        await spell.load_code(code_data, 24)
+    recorder = None
+    if trace:
+        recorder = TraceRecorder(dut, await spell.clock_period_steps())
+    start = time.perf_counter()
+    cycles = await spell.run_until()
+    wall = time.perf_counter() - start
+    if recorder:
+        recorder.stop()
+    return cycles, wall, recorder
+
+
+@cocotb.test()
+async def test_bench(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    if BENCH_MEMORY == "sram":
+        spell.enable_rambus()
+
+    timing = TIMING[BENCH_CONFIG]
+    results = []
+    for name, (code, code_data) in PROGRAMS.items():
+        model = SpellModel()
+        model.cycles_per_ms = CYCLES_PER_MS
+        model.load_code(code)
+        model.load_code(code_data, 24)
+        instructions = model.run()
+        estimate = timing.model_cycles(model)
+
+        # The profile comes from a traced run, the wall time from an untraced one
+        _, _, recorder = await run_program(dut, spell, code, code_data, trace=True)
+        cycles, wall, _ = await run_program(dut, spell, code, code_data)
+
+        logic_data = spell.logic_read()
+        assert (logic_data["pc"], logic_data["sp"], logic_data["top"]) == (
+            model.pc,
+            model.sp,
+            model.top,
+        ), name
+        assert len(recorder) == instructions, name
+        assert recorder.state_cycles() == estimate, name
+        assert cycles == sum(estimate.values()), name
+
+        results.append(
+            {
+                "program": name,
+                "config": BENCH_CONFIG,
+                "instructions": instructions,
+                "cycles": cycles,
+                "cpi": cycles / instructions,
+                "state_cycles": recorder.state_cycles(),
+                "estimated_cycles": sum(estimate.values()),
+                "wall_s": wall,
+                "wall_us_per_cycle": wall * 1e6 / cycles,
+            }
+        )
+        dut._log.info("%s: CPI %.2f\n%s" % (name, cycles / instructions, recorder.report(8)))
+
+    with open(BENCH_OUTPUT, "w") as f:
+        json.dump(results, f, indent=2)
+
+    clock_sig.kill()
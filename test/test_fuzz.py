@@ -0,0 +1,178 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Constrained-random tests for the spell core. See test/fuzz.py for how to run them.
+
+SPELL_FUZZ_SEED and SPELL_FUZZ_PROGRAMS select the seed and the number of
+programs per test.
+"""
+
+import os
+import random
+
+import cocotb
+from test.fuzz import (
+    CODE_SIZE,
+    DATA_ADDRS,
+    DATA_SIZE,
+    LITERALS,
+    SCRATCH,
+    SCRATCH_ADDRS,
+    ProgramGenerator,
+    assemble,
+    format_program,
+    minimize,
+)
+from test.spell_model import SpellModel
+from test.test_spell import create_spell, make_clock, reg_cycles_per_ms, reset
+
+FUZZ_SEED = int(os.environ.get("SPELL_FUZZ_SEED", "1"))
+FUZZ_PROGRAMS = int(os.environ.get("SPELL_FUZZ_PROGRAMS", "100"))
+
+# Keeps ',' delays short
+CYCLES_PER_MS = 3
+
+EXEC_OPCODES = "+-&|^<>x2?rw!"
+
+
+async def run_rtl(dut, spell, program, io_in):
+    await reset(dut)
+    dut.io_in.value = io_in
+    await spell.wb_write(reg_cycles_per_ms, CYCLES_PER_MS)
+    await spell.load_code(program)
+    await spell.execute()
+    logic_data = spell.logic_read()
+    return (
+        logic_data["pc"],
+        logic_data["sp"],
+        logic_data["top"],
+        await spell.peek(0, DATA_SIZE, data=True),
+        await spell.peek(SCRATCH, CODE_SIZE - SCRATCH),
+        dut.io_out.value.integer,
+        dut.io_oeb.value.integer,
+    )
+
+
+def run_model(program, io_in):
+    model = SpellModel()
+    model.cycles_per_ms = CYCLES_PER_MS
+    model.io_in = io_in
+    model.load_code(program)
+    model.run()
+    return (
+        model.pc,
+        model.sp,
+        model.top,
+        bytes(model.data[:DATA_SIZE]),
+        bytes(model.code[SCRATCH:CODE_SIZE]),
+        model.io_out,
+        model.io_oeb,
+    )
+
+
+def write_failure(text):
+    with open("failure.txt", "w") as f:
+        f.write(text + "\n")
+
+
+@cocotb.test()
+async def test_fuzz_programs(dut):
+    """
+    Random programs must leave the RTL in the same state as the reference model
+    """
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+
+    for index in range(FUZZ_PROGRAMS):
+        rng = random.Random("%d:%d" % (FUZZ_SEED, index))
+        blocks = ProgramGenerator(rng).generate()
+        io_in = rng.randrange(256)
+
+        async def still_fails(candidate):
+            program = assemble(candidate)
+            return await run_rtl(dut, spell, program, io_in) != run_model(program, io_in)
+
+        if await still_fails(blocks):
+            blocks = await minimize(blocks, still_fails)
+            program = assemble(blocks)
+            message = "Seed %d program #%d, minimized (io_in=%d):\n  %s\nRTL:   %s\nModel: %s" % (
+                FUZZ_SEED,
+                index,
+                io_in,
+                format_program(program),
+                await run_rtl(dut, spell, program, io_in),
+                run_model(program, io_in),
+            )
+            write_failure(message)
+            assert False, message
+
+    clock_sig.kill()
+
+
+async def exec_state(dut, spell):
+    # The in-order run keeps its code in the first two scratch bytes
+    logic_data = spell.logic_read()
+    return (
+        logic_data["sp"],
+        logic_data["top"],
+        await spell.peek(0, DATA_SIZE, data=True),
+        await spell.peek(SCRATCH + 2, CODE_SIZE - SCRATCH - 2),
+        dut.io_out.value.integer,
+    )
+
+
+@cocotb.test()
+async def test_fuzz_exec(dut):
+    """
+    Executing an opcode through REG_EXEC must match running it from code memory
+    """
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+
+    for index in range(FUZZ_PROGRAMS):
+        rng = random.Random("exec:%d:%d" % (FUZZ_SEED, index))
+        opcode = rng.choice(EXEC_OPCODES) if rng.random() < 0.9 else rng.choice(LITERALS)
+        below = rng.choice(LITERALS)
+        if opcode == "?":
+            # Not the two scratch bytes that the in-order run below loads its code into
+            top = rng.choice(list(range(SCRATCH)) + SCRATCH_ADDRS[2:])
+        elif opcode in ("r", "w"):
+            top = rng.choice(DATA_ADDRS)
+        elif opcode == "!":
+            # Don't let the in-order run below store over its own code
+            top = rng.choice(SCRATCH_ADDRS[2:])
+        else:
+            top = rng.choice(LITERALS)
+        io_in = rng.randrange(256)
+
+        # Out of order, through REG_EXEC
+        await reset(dut)
+        dut.io_in.value = io_in
+        await spell.push(below)
+        await spell.push(top)
+        pc = spell.logic_read()["pc"]
+        await spell.exec_step(opcode)
+        assert spell.logic_read()["pc"] == pc
+        out_of_order = await exec_state(dut, spell)
+
+        # In order, from code memory, followed by 'z'
+        await reset(dut)
+        dut.io_in.value = io_in
+        await spell.push(below)
+        await spell.push(top)
+        await spell.load_code([opcode, "z"], SCRATCH)
+        await spell.set_pc(SCRATCH)
+        await spell.execute()
+        assert spell.logic_read()["pc"] == SCRATCH + 2
+        in_order = await exec_state(dut, spell)
+
+        assert out_of_order == in_order, "opcode %r with stack [%d, %d]: %s != %s" % (
+            opcode,
+            below,
+            top,
+            out_of_order,
+            in_order,
+        )
+
+    clock_sig.kill()
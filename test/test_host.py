@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+End-to-end throughput of the spell core fed by the interrupt-driven host model
+of test/host.py. Run with ``make host_throughput``.
+
+SPELL_HOST_JOBS sets the number of jobs per test, and the throughput reports
+are written as JSON to SPELL_HOST_OUTPUT (default: host.json).
+"""
+
+import json
+import os
+import random
+
+import cocotb
+from test.host import HostJobQueue, Job
+from test.spell_model import HALT_STOP, REG_DDR, REG_PIN, REG_PORT, SpellModel
+from test.test_spell import create_spell, make_clock, reset
+
+HOST_JOBS = int(os.environ.get("SPELL_HOST_JOBS", "50"))
+HOST_OUTPUT = os.environ.get("SPELL_HOST_OUTPUT", "host.json")
+
+_reports = {}
+
+
+def make_jobs(count, seed=1):
+    """Returns a mix of jobs: additions, multiplications, GPIO reads and writes"""
+    rng = random.Random(seed)
+    jobs = []
+    for index in range(count):
+        kind = index % 4
+        if kind == 0:
+            code = [rng.randrange(1, 0x20), rng.randrange(1, 0x20), "+", "z"]
+            jobs.append(Job(code, name="add"))
+        elif kind == 1:
+            # a * b by repeated addition, with a in data[0]
+            a = rng.randrange(1, 0x20)
+            b = rng.randrange(1, 10)
+            code = [0, b - 1, "x", 0, "r", "+", "x", 2, "@", "z"]
+            jobs.append(Job(code, data=[a], name="multiply"))
+        elif kind == 2:
+            jobs.append(Job([REG_PIN, "r", "z"], io_in=rng.randrange(256), name="gpio_in"))
+        else:
+            value = rng.randrange(1, 0x20)
+            code = [0x0F, REG_DDR, "w", value, REG_PORT, "w", 0xFF]
+            jobs.append(Job(code, name="gpio_out"))
+    return jobs
+
+
+def expected(job, sram):
+    model = SpellModel(256, 256) if sram else SpellModel()
+    model.load_code(job.code)
+    model.data[: len(job.data)] = bytes(job.data)
+    if job.io_in is not None:
+        model.io_in = job.io_in
+    model.run()
+    return {
+        "name": job.name,
+        "pc": model.pc,
+        "sp": model.sp,
+        "top": model.top,
+        "stopped": model.halted == HALT_STOP,
+    }
+
+
+async def run_queue(dut, name, sram=False, edge_interrupts=False):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    host = HostJobQueue(dut, spell, sram=sram, edge_interrupts=edge_interrupts)
+    jobs = make_jobs(HOST_JOBS)
+    for job in jobs:
+        host.submit(job)
+    results = await host.run()
+
+    for job, result in zip(jobs, results):
+        io_out = result.pop("io_out")
+        assert result == expected(job, sram)
+        if job.name == "gpio_out":
+            assert io_out == job.code[3]
+    report = host.report()
+    dut._log.info(
+        "%s: %.0f jobs/s, %.1f bus ops/job, %.1f host + %.1f run cycles/job"
+        % (
+            name,
+            report["jobs_per_second"],
+            report["bus_ops_per_job"],
+            report["host_cycles_per_job"],
+            report["run_cycles_per_job"],
+        )
+    )
+    _reports[name] = report
+    with open(HOST_OUTPUT, "w") as f:
+        json.dump(_reports, f, indent=2)
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_host_dff(dut):
+    await run_queue(dut, "dff")
+
+
+@cocotb.test()
+async def test_host_sram_edge(dut):
+    await run_queue(dut, "sram_edge", sram=True, edge_interrupts=True)
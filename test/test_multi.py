@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Tests that run on every core of `spell_multi` at once. See test/multi_top.py
+for how to build and run them.
+
+`run_on_cores` hands out jobs to the cores: each job is a coroutine function
+called with the core's handle and its SpellController, and one job runs on
+each core at a time. The fuzz test checks SPELL_FUZZ_PROGRAMS random programs
+from seed SPELL_FUZZ_SEED against the reference model, like test_fuzz.py.
+"""
+
+import os
+import random
+
+import cocotb
+from test.fuzz import ProgramGenerator, assemble, format_program
+from test.spell_model import REG_DDR, REG_PORT
+from test.test_fuzz import run_model, run_rtl
+from test.test_spell import SpellController, create_wishbone, make_clock, reset
+
+FUZZ_SEED = int(os.environ.get("SPELL_FUZZ_SEED", "1"))
+FUZZ_PROGRAMS = int(os.environ.get("SPELL_FUZZ_PROGRAMS", "100"))
+
+
+class CoreHandle:
+    """
+    Looks like the `spell` top to SpellController, for core `index` of spell_multi:
+    inputs are the core<index>_* regs of the top, everything else comes from the
+    instance, and the clock is shared.
+    """
+
+    def __init__(self, dut, index):
+        self._dut = dut
+        self._core = getattr(dut, "core%d" % index)
+        self._prefix = "core%d_" % index
+        self.index = index
+        self.clock = dut.clock
+
+    def __getattr__(self, name):
+        if not name.startswith("_"):
+            try:
+                return getattr(self._dut, self._prefix + name)
+            except AttributeError:
+                pass
+        return getattr(self._core, name)
+
+
+def core_handles(dut):
+    handles = []
+    while hasattr(dut, "core%d" % len(handles)):
+        handles.append(CoreHandle(dut, len(handles)))
+    return handles
+
+
+async def run_on_cores(dut, jobs, clock_mhz=10):
+    """
+    Runs `jobs`, coroutine functions taking (core, spell), on all cores of
+    spell_multi, one at a time per core. Returns their results in job order.
+    """
+    cores = core_handles(dut)
+    clock_sig = await make_clock(dut, clock_mhz)
+    results = [None] * len(jobs)
+    pending = list(enumerate(jobs))
+    pending.reverse()
+
+    async def worker(core):
+        core.reset.value = 1
+        core.io_in.value = 0
+        spell = SpellController(core, create_wishbone(core))
+        while pending:
+            index, job = pending.pop()
+            results[index] = await job(core, spell)
+        spell.close()
+
+    workers = [cocotb.fork(worker(core)) for core in cores]
+    for task in workers:
+        await task
+    clock_sig.kill()
+    return results
+
+
+@cocotb.test()
+async def test_multi_independent(dut):
+    """Every core computes its own sum and drives its own GPIO"""
+    cores = core_handles(dut)
+    values = [index % 16 + 1 for index in range(len(cores))]
+
+    def job(value):
+        async def run(core, spell):
+            await reset(core)
+            await spell.load_code([value, 10, "+", 0x0F, REG_DDR, "w", value, REG_PORT, "w", "z"])
+            await spell.execute()
+            return spell.logic_read()["top"], core.io_out.value.integer
+
+        return run
+
+    results = await run_on_cores(dut, [job(value) for value in values])
+    assert results == [(value + 10, value) for value in values]
+
+
+@cocotb.test()
+async def test_multi_fuzz(dut):
+    """Random programs, spread over all cores, must match the reference model"""
+
+    def job(index):
+        async def run(core, spell):
+            rng = random.Random("%d:%d" % (FUZZ_SEED, index))
+            program = assemble(ProgramGenerator(rng).generate())
+            io_in = rng.randrange(256)
+            return program, io_in, await run_rtl(core, spell, program, io_in)
+
+        return run
+
+    results = await run_on_cores(dut, [job(index) for index in range(FUZZ_PROGRAMS)])
+    for index, (program, io_in, rtl) in enumerate(results):
+        model = run_model(program, io_in)
+        assert rtl == model, "Seed %d program #%d (io_in=%d):\n  %s\nRTL:   %s\nModel: %s" % (
+            FUZZ_SEED,
+            index,
+            io_in,
+            format_program(program),
+            rtl,
+            model,
+        )
@@ -1,12 +1,33 @@
 # SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
 # SPDX-License-Identifier: MIT
 
+import atexit
+
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import ClockCycles
+from cocotb.result import SimTimeoutError
+from cocotb.triggers import ClockCycles, Edge, First, ReadWrite, RisingEdge, Timer
+from cocotb.utils import get_sim_time
 from cocotbext.wishbone.driver import WishboneMaster, WBOp
+from test.call_profile import PROFILE, CallProfile, profiled
+from test.coverage import BINS, Coverage
+from test.coverage_monitor import CoverageMonitor, start_coverage
 from test.edge_monitor import RisingEdgeCounter
-from test.wb_ram import WishboneRAM
+from test.lockstep import LockstepChecker
+from test.perf import current_test_name, start_test as start_perf
+from test.spell_asm import assemble
+from test.spell_model import SpellModel, to_opcode
+from test.spell_timing import DFF_DELAY_CYCLES, CycleModel
+from test.trace import TraceRecorder
+from test.waveform import Waveform
+from test.wb_ram import (
+    CODE_REGION,
+    DATA_REGION,
+    BurstyLatency,
+    RandomLatency,
+    RegionLatency,
+    WishboneRAM,
+)
 
 
 def bit(n):
@@ -43,6 +64,13 @@ stateNames = [
     "Invalid",
 ]
 
+STATE_SLEEP = stateNames.index("Sleep")
+
+# Memory sizes of the core and spell_mem_dff
+STACK_SIZE = 32
+DFF_CODE_SIZE = 32
+DFF_DATA_SIZE = 8
+
 wishbone_signals = {
     "cyc": "i_wb_cyc",
     "stb": "i_wb_stb",
@@ -77,34 +105,265 @@ async def make_clock(dut, clock_mhz):
     dut._log.info("input clock = %d MHz, period = %.2f ns" % (clock_mhz, clk_period_ns))
     clock = Clock(dut.clock, clk_period_ns, units="ns")
     clock_sig = cocotb.fork(clock.start())
+    start_perf(clk_period_ns)
     return clock_sig
 
 
+# Registers saved by SpellController.snapshot(), as paths below the spell module
+SNAPSHOT_REGISTERS = [
+    ("pc",),
+    ("sp",),
+    ("state",),
+    ("opcode",),
+    ("memory_input",),
+    ("cycles_per_ms",),
+    ("delay_counter",),
+    ("delay_cycles",),
+    ("intr",),
+    ("intr_enable",),
+    ("edge_interrupts",),
+    ("prev_level_interrupt",),
+    ("single_step",),
+    ("out_of_order_exec",),
+    ("sram_enable",),
+    ("mem", "mem_io", "io_out"),
+    ("mem", "mem_io", "io_oeb"),
+]
+SNAPSHOT_ARRAYS = [
+    ("stack",),
+    ("mem", "mem_dff", "code_mem"),
+    ("mem", "mem_dff", "data_mem"),
+]
+
+
+class RegisterBatch:
+    """
+    Queues register accesses and sends them with as few Wishbone cycles as possible::
+
+        batch = spell.batch()
+        batch.push(1)
+        batch.push(2)
+        batch.exec("+")
+        await batch.send()
+
+    `send()` returns the values of the queued reads, in order. Consecutive writes
+    go out as one cycle, but every read gets a cycle of its own: the ack and
+    o_wb_data of spell.v are registered, so the bus master can't tell the
+    responses of back-to-back reads apart. A push right after another write gets
+    one idle cycle, since spell.v ignores REG_STACK_PUSH when the previous cycle
+    was a register write. An opcode queued with `exec` must come last: `send()`
+    waits for it to complete.
+    """
+
+    def __init__(self, spell):
+        self._spell = spell
+        self._ops = []
+        self._stop_first = False
+        self._exec = False
+
+    def __len__(self):
+        return len(self._ops)
+
+    def read(self, addr):
+        self._queue(addr, None)
+
+    def write(self, addr, value):
+        self._queue(addr, value)
+
+    def push(self, value):
+        self._stop_first = True
+        self._queue(reg_stack_push, to_opcode(value))
+
+    def set_pc(self, value):
+        self._queue(reg_pc, value)
+
+    def set_sp(self, value):
+        self._queue(reg_sp, value)
+
+    def exec(self, opcode):
+        self._stop_first = True
+        self._queue(reg_exec, to_opcode(opcode))
+        self._exec = True
+
+    def _queue(self, addr, value):
+        if self._exec:
+            raise ValueError("exec must be the last operation of a batch")
+        self._ops.append((addr, value))
+
+    async def send(self):
+        ops = self._ops
+        spell = self._spell
+        if self._stop_first:
+            await spell.ensure_cpu_stopped()
+        # The logic analyzer port only writes: it streams each run of writes instead
+        send_writes = spell._la_writes if spell.use_la_write else spell.wb_write_cycle
+        results = []
+        writes = []
+        for addr, value in ops:
+            if value is not None:
+                writes.append((addr, value))
+                continue
+            if writes:
+                await send_writes(writes)
+                writes = []
+            results.append(await spell.wb_read(addr))
+        if writes:
+            await send_writes(writes)
+        if self._exec:
+            await spell.ensure_cpu_stopped()
+        self._ops = []
+        self._stop_first = False
+        self._exec = False
+        return results
+
+
 class SpellController:
     def __init__(self, dut, wishbone):
         self._dut = dut
         self._wishbone = wishbone
+        self.wbram = WishboneRAM(dut, dut.rambus_wb_clk_o, ram_bus_signals)
+        self.sram = self.wbram.data
+        self._init_state()
+        # Memory arrays are only visible in RTL simulation, not in the gate-level netlist
+        self._code_mem = self._find_handle("mem", "mem_dff", "code_mem")
+        self._data_mem = self._find_handle("mem", "mem_dff", "data_mem")
+
+    def _init_state(self):
         self._ctrl_flags = 0
-        self._wbram = WishboneRAM(dut, dut.rambus_wb_clk_o, ram_bus_signals)
-        self.sram = self._wbram.data
-        dut.i_la_wb_disable = False  # Wishbone enabled by default
-        dut.i_la_write.value = False
+        self._int_enable = 0
+        self._clock_period = None
+        self._dut.i_la_wb_disable.value = False  # Wishbone enabled by default
+        self._dut.i_la_write.value = False
         self.use_la_write = False
+        # Register accesses by this controller, ensure_cpu_stopped included
+        self.wb_reads = 0
+        self.wb_writes = 0
+        self.la_writes = 0
+        # Bus and cycle accounting per call, see test/call_profile.py
+        self.profile = CallProfile(current_test_name()) if PROFILE else None
+
+    def start_test(self, wishbone):
+        """
+        Prepares a controller left over from a previous test for the next one: the
+        host-side state goes back to its defaults, the SRAM is cleared and serving
+        again. Takes a new WishboneMaster if the old one was left mid-cycle.
+        """
+        self.close()
+        self._wishbone = wishbone
+        self._init_state()
+        self.sram[:] = bytes(len(self.sram))
+        self.wbram.latency = 0
+        self.wbram.reset_counters()
+        self.wbram.start()
+
+    def close(self):
+        """
+        Ends the current test: logs the call profile and stops the SRAM responder.
+        Controllers from create_spell are closed by the next test's create_spell,
+        and the last one when the simulator exits.
+        """
+        self.log_profile()
+        self.wbram.close()
+
+    def log_profile(self):
+        """Logs the call profile, if there is one, and stops profiling"""
+        if self.profile is not None:
+            self._dut._log.info("\n" + self.profile.report())
+            self.profile = None
+
+    def _count(self, wb_reads=0, wb_writes=0, la_writes=0):
+        self.wb_reads += wb_reads
+        self.wb_writes += wb_writes
+        self.la_writes += la_writes
+        if self.profile is not None:
+            self.profile.count(wb_reads, wb_writes, la_writes)
+
+    def bus_ops(self):
+        """Returns the number of register reads and writes so far, on either port"""
+        return self.wb_reads + self.wb_writes + self.la_writes
+
+    def _find_handle(self, *path):
+        handle = self._dut
+        for name in path:
+            if not hasattr(handle, name):
+                return None
+            handle = getattr(handle, name)
+        return handle
 
     async def wb_read(self, addr):
         res = await self._wishbone.send_cycle([WBOp(addr)])
+        self._count(wb_reads=1)
         return res[0].datrd
 
+    def _note_write(self, addr, value):
+        if addr == reg_int_enable:
+            self._int_enable = value
+
     async def wb_write(self, addr, value):
+        self._note_write(addr, value)
         if self.use_la_write:
-            self._dut.i_la_write.value = 1
-            self._dut.i_la_addr.value = addr
-            self._dut.i_la_data.value = value
-            await ClockCycles(self._dut.clock, 1)
-            self._dut.i_la_write.value = 0
-            await ClockCycles(self._dut.clock, 1)
+            await self._la_writes([(addr, value)])
         else:
             await self._wishbone.send_cycle([WBOp(addr, value)])
+            self._count(wb_writes=1)
+
+    async def wb_write_cycle(self, writes):
+        """
+        Writes (register address, value) pairs in a single Wishbone cycle. A push
+        after another write gets one idle cycle, which spell.v needs to see it.
+        """
+        ops = []
+        for addr, value in writes:
+            self._note_write(addr, value)
+            idle = 1 if addr == reg_stack_push and ops else 0
+            ops.append(WBOp(addr, value, idle=idle))
+        await self._wishbone.send_cycle(ops)
+        self._count(wb_writes=len(ops))
+
+    async def la_write_stream(self, writes):
+        """
+        Writes an iterable of (register address, 8-bit value) pairs through the logic
+        analyzer port, one per clock cycle. Only a REG_STACK_PUSH right after another
+        write waits an idle cycle, which spell.v needs to see the push. The writes
+        don't wait for the CPU, so use them for register loads rather than REG_EXEC.
+
+        Returns a dict with the number of writes, the clock cycles they took and the
+        writes per cycle.
+        """
+        await self.ensure_cpu_stopped()
+        writes, cycles = await self._la_writes(writes)
+        return {
+            "writes": writes,
+            "cycles": cycles,
+            "writes_per_cycle": writes / cycles if cycles else 0.0,
+        }
+
+    async def _la_writes(self, writes):
+        dut = self._dut
+        clkedge = RisingEdge(dut.clock)
+        la_write = dut.i_la_write
+        la_addr = dut.i_la_addr
+        la_data = dut.i_la_data
+        count = 0
+        cycles = 0
+        for addr, value in writes:
+            self._note_write(addr, value)
+            if addr == reg_stack_push and count:
+                la_write.value = 0
+                await clkedge
+                cycles += 1
+            la_write.value = 1
+            la_addr.value = addr & 0x7F
+            la_data.value = value & 0xFF
+            await clkedge
+            cycles += 1
+            count += 1
+        la_write.value = 0
+        if count:
+            # Leave a gap, in case the next write is a push
+            await clkedge
+            self._count(la_writes=count)
+        return count, cycles
 
     def enable_rambus(self):
         self._ctrl_flags |= CTRL_SRAM_ENABLE
@@ -124,23 +383,101 @@ class SpellController:
             "top": (value >> 24) & 0xFF,
         }
 
+    def _state(self):
+        return (self._dut.la_data_out.value.integer >> 21) & 0x7
+
+    @profiled
     async def ensure_cpu_stopped(self):
-        logic = self.logic_read()
-        while not logic["stopped"]:
-            await self.wb_write(reg_ctrl, self._ctrl_flags | CTRL_STEP)
-            logic = self.logic_read()
+        if self._state() == STATE_SLEEP:
+            return
+        # Single-step mode makes the CPU sleep once the current instruction completes
+        await self.wb_write(reg_ctrl, self._ctrl_flags | CTRL_STEP)
+        while self._state() != STATE_SLEEP:
+            await Edge(self._dut.la_data_out)
+
+    async def clock_period_steps(self):
+        if self._clock_period is None:
+            await RisingEdge(self._dut.clock)
+            start = get_sim_time()
+            await RisingEdge(self._dut.clock)
+            self._clock_period = get_sim_time() - start
+        return self._clock_period
+
+    async def _wait_started(self):
+        while self._state() == STATE_SLEEP:
+            await Edge(self._dut.la_data_out)
+        return get_sim_time()
+
+    async def _wait_interrupt(self):
+        while not self._dut.interrupt.value:
+            await RisingEdge(self._dut.interrupt)
+
+    async def _wait_pc(self, pc):
+        while True:
+            await Edge(self._dut.la_data_out)
+            if self._dut.la_data_out.value.integer & 0xFF == pc:
+                return
+
+    async def run_until(self, pc=None, cycles=None, timeout=None, timeout_unit="ns"):
+        """
+        Starts the CPU and waits until it sleeps or stops, reaches `pc`, or has run
+        for `cycles` clock cycles. Returns the number of clock cycles it ran for.
+
+        Waits on the interrupt line and on changes of `la_data_out` instead of polling
+        the bus, so the simulation free-runs while the program executes. Interrupts
+        pending from a previous run are cleared. When returning on a `pc` or `cycles`
+        condition the CPU is left running.
+        """
+        period = await self.clock_period_steps()
+        await self.ensure_cpu_stopped()
+
+        # Arm the sleep and stop interrupts for the duration of the run
+        int_enable = self._int_enable
+        await self.wb_write(reg_int, INTR_SLEEP | INTR_STOP)
+        if int_enable != INTR_SLEEP | INTR_STOP:
+            await self.wb_write(reg_int_enable, INTR_SLEEP | INTR_STOP)
+
+        # Start watching before the CPU starts, so that a short program can't race us
+        started = cocotb.fork(self._wait_started())
+        waiters = [cocotb.fork(self._wait_interrupt())]
+        if pc is not None:
+            waiters.append(cocotb.fork(self._wait_pc(pc)))
+        triggers = list(waiters)
+        if cycles is not None:
+            triggers.append(ClockCycles(self._dut.clock, cycles))
+        timer = None
+        if timeout is not None:
+            timer = Timer(timeout, timeout_unit)
+            triggers.append(timer)
+
+        await self.wb_write(reg_ctrl, self._ctrl_flags | CTRL_RUN)
+        fired = await First(*triggers)
+        end = get_sim_time()
+        for waiter in waiters:
+            waiter.kill()
+
+        if int_enable != INTR_SLEEP | INTR_STOP:
+            await self.wb_write(reg_int_enable, int_enable)
+        if fired is timer:
+            started.kill()
+            raise SimTimeoutError("CPU still running after {} {}".format(timeout, timeout_unit))
+        start = await started
+        return (end - start) // period
 
     async def single_step(self):
         await self.ensure_cpu_stopped()
         await self.wb_write(reg_ctrl, self._ctrl_flags | CTRL_STEP | CTRL_RUN)
         await self.ensure_cpu_stopped()
 
+    @profiled
     async def execute(self, wait=True):
+        if wait:
+            await self.run_until()
+            return
         await self.ensure_cpu_stopped()
         await self.wb_write(reg_ctrl, self._ctrl_flags | CTRL_RUN)
-        while wait and (await self.wb_read(reg_ctrl) & CTRL_RUN):
-            pass
 
+    @profiled
     async def exec_step(self, opcode):
         if type(opcode) == str:
             opcode = ord(opcode)
@@ -148,6 +485,7 @@ class SpellController:
         await self.wb_write(reg_exec, opcode)
         await self.ensure_cpu_stopped()
 
+    @profiled
     async def push(self, value):
         await self.ensure_cpu_stopped()
         await self.wb_write(reg_stack_push, value)
@@ -158,6 +496,48 @@ class SpellController:
     async def set_sp(self, value):
         await self.wb_write(reg_sp, value)
 
+    def batch(self):
+        return RegisterBatch(self)
+
+    def _snapshot_handles(self):
+        registers = [self._find_handle(*path) for path in SNAPSHOT_REGISTERS]
+        arrays = [self._find_handle(*path) for path in SNAPSHOT_ARRAYS]
+        if None in registers or None in arrays:
+            raise RuntimeError("State snapshots need the RTL, the core's registers are not visible")
+        return registers, arrays
+
+    async def snapshot(self):
+        """
+        Stops the CPU and captures the state of the core, its memories, GPIO outputs
+        and the Wishbone SRAM, to be reinstated with `restore`.
+        """
+        await self.ensure_cpu_stopped()
+        registers, arrays = self._snapshot_handles()
+        return {
+            "registers": [handle.value for handle in registers],
+            "arrays": [[item.value for item in array] for array in arrays],
+            "sram": bytes(self.sram),
+            "ctrl_flags": self._ctrl_flags,
+            "int_enable": self._int_enable,
+        }
+
+    async def restore(self, snapshot):
+        """Reinstates a state captured with `snapshot`, one simulation step later"""
+        await self.ensure_cpu_stopped()
+        registers, arrays = self._snapshot_handles()
+        for handle, value in zip(registers, snapshot["registers"]):
+            handle.value = value
+        for array, values in zip(arrays, snapshot["arrays"]):
+            for item, value in zip(array, values):
+                item.value = value
+        self.sram[:] = snapshot["sram"]
+        self._ctrl_flags = snapshot["ctrl_flags"]
+        self._int_enable = snapshot["int_enable"]
+        await ReadWrite()
+        # Let continuous assigns such as la_data_out settle on the restored registers.
+        # A step instead of ReadOnly, so that callers can drive signals right away.
+        await Timer(1, units="step")
+
     async def set_sp_read_stack(self, index):
         await self.set_sp(index)
         return await self.wb_read(reg_stack_top)
@@ -166,28 +546,170 @@ class SpellController:
         """
         Writes a value to progmem by executing an instruction on the CPU.
         """
-        if type(value) == str:
-            value = ord(value)
-        await self.push(value)
-        await self.push(addr)
-        await self.exec_step("!")
+        batch = self.batch()
+        batch.push(value)
+        batch.push(addr)
+        batch.exec("!")
+        await batch.send()
 
+    @profiled
     async def write_program(self, opcodes, offset=0):
         for index, opcode in enumerate(opcodes):
             await self.write_progmem(offset + index, opcode)
 
+    async def load_code(self, opcodes, offset=0):
+        """
+        Writes opcodes straight into code memory, without executing any instructions.
+        Falls back to `write_program` when the memory arrays are not accessible.
+        """
+        opcodes = [to_opcode(opcode) for opcode in opcodes]
+        if self._ctrl_flags & CTRL_SRAM_ENABLE:
+            for index, value in enumerate(opcodes):
+                self.sram[offset + index] = value
+        elif self._code_mem is not None:
+            await self._poke_array(self._code_mem, offset, opcodes)
+        else:
+            await self.write_program(opcodes, offset)
+
+    async def load_data(self, values, offset=0):
+        """
+        Writes values straight into data memory, without executing any instructions.
+        Falls back to the "w" opcode when the memory arrays are not accessible.
+        """
+        if self._ctrl_flags & CTRL_SRAM_ENABLE:
+            for index, value in enumerate(values):
+                self.sram[256 + offset + index] = value
+        elif self._data_mem is not None:
+            await self._poke_array(self._data_mem, offset, values)
+        else:
+            for index, value in enumerate(values):
+                batch = self.batch()
+                batch.push(value)
+                batch.push(offset + index)
+                batch.exec("w")
+                await batch.send()
+
+    async def peek(self, addr, count=1, data=False):
+        """
+        Reads `count` bytes of code memory (or data memory, if `data` is set) starting at `addr`.
+        """
+        if self._ctrl_flags & CTRL_SRAM_ENABLE:
+            base = 256 + addr if data else addr
+            return bytes(self.sram[base : base + count])
+        array = self._data_mem if data else self._code_mem
+        if array is not None:
+            return bytes(
+                int(array[index].value) if index < len(array) else 0
+                for index in range(addr, addr + count)
+            )
+        result = bytearray()
+        for index in range(addr, addr + count):
+            await self.push(index)
+            await self.exec_step("r" if data else "?")
+            logic = self.logic_read()
+            result.append(logic["top"])
+            await self.set_sp(logic["sp"] - 1)
+        return bytes(result)
+
+    async def dump_state(self, bus=False):
+        """
+        Stops the CPU and returns a dict with sp and the whole stack, code memory and
+        data memory as bytes. The stack and DFF memories are read through their
+        handles where the simulator exposes them, and the SRAM from `self.sram`.
+        Otherwise (or with `bus` set) they are read over the bus, one value per
+        read cycle, leaving sp and the stack as they were.
+        """
+        await self.ensure_cpu_stopped()
+        sp = self.logic_read()["sp"]
+        stack = self._find_handle("stack")
+        if stack is not None and not bus:
+            stack = bytes(int(stack[index].value) for index in range(STACK_SIZE))
+        else:
+            values = []
+            for index in range(STACK_SIZE):
+                # The top of the stack is the entry below sp
+                values.append(await self.set_sp_read_stack((index + 1) % STACK_SIZE))
+            await self.set_sp(sp)
+            stack = bytes(int(value) & 0xFF for value in values)
+
+        if self._ctrl_flags & CTRL_SRAM_ENABLE:
+            code = bytes(self.sram[0:256])
+            data = bytes(self.sram[256:512])
+        elif self._code_mem is not None and self._data_mem is not None and not bus:
+            code = await self.peek(0, len(self._code_mem))
+            data = await self.peek(0, len(self._data_mem), data=True)
+        else:
+            code = await self._dump_memory("?", DFF_CODE_SIZE, sp)
+            data = await self._dump_memory("r", DFF_DATA_SIZE, sp)
+            # Reading memory overwrote the stack entry at sp
+            batch = self.batch()
+            batch.set_sp((sp + 1) % STACK_SIZE)
+            batch.write(reg_stack_top, stack[sp])
+            batch.set_sp(sp)
+            await batch.send()
+        return {"sp": sp, "stack": stack, "code": code, "data": data}
+
+    async def _dump_memory(self, opcode, size, sp):
+        """Reads `size` bytes by executing `opcode` on each address, pushed at `sp`"""
+        values = []
+        batch = self.batch()
+        for addr in range(size):
+            batch.set_sp(sp)
+            batch.push(addr)
+            batch.exec(opcode)
+            await batch.send()
+            values.append(await self.wb_read(reg_stack_top))
+        return bytes(int(value) & 0xFF for value in values)
+
+    async def _poke_array(self, array, offset, values):
+        size = len(array)
+        for index, value in enumerate(values):
+            if offset + index < size:
+                array[offset + index].value = value
+        # Writes are applied in the next ReadWrite phase of the current timestep
+        await ReadWrite()
+
+
+def create_wishbone(dut):
+    return WishboneMaster(dut, "", dut.clock, width=32, timeout=10, signals_dict=wishbone_signals)
+
+
+# The controller is created once per simulation and reused by every test, see create_spell
+_spell = None
+
+
+def _close_spell():
+    if _spell is not None:
+        _spell.close()
+
 
 async def create_spell(dut):
+    """
+    Returns the SpellController of this simulation, reset for a new test. The bus
+    master, SRAM model and signal handles are only created by the first test,
+    which also registers the teardown of the last test at exit. The clock can't
+    be shared: cocotb kills forked coroutines at the end of every test, so each
+    test starts its own with make_clock.
+    """
     if hasattr(dut, "VPWR"):
         # Running a gate-level simulation, connect the power and ground signals
         dut.VGND <= 0
         dut.VPWR <= 1
 
-    wishbone = WishboneMaster(
-        dut, "", dut.clock, width=32, timeout=10, signals_dict=wishbone_signals
-    )
-    spell = SpellController(dut, wishbone)
-    return spell
+    start_coverage(dut)
+    global _spell
+    if _spell is not None and _spell._dut is dut:
+        wishbone = _spell._wishbone
+        if wishbone.busy:
+            wishbone = create_wishbone(dut)
+        _spell.start_test(wishbone)
+        return _spell
+    if _spell is None:
+        atexit.register(_close_spell)
+    else:
+        _spell.close()
+    _spell = SpellController(dut, create_wishbone(dut))
+    return _spell
 
 
 @cocotb.test()
@@ -215,7 +737,7 @@ async def test_add(dut):
 @cocotb.test()
 async def test_add_la(dut):
     spell = await create_spell(dut)
-    dut.i_la_wb_disable = True
+    dut.i_la_wb_disable.value = True
     spell.use_la_write = True
     clock_sig = await make_clock(dut, 10)
     await reset(dut)
@@ -540,7 +1062,7 @@ async def test_io(dut):
     await spell.exec_step("w")
     assert dut.io_out.value == 0x60
 
-    dut.io_in = 0x7A
+    dut.io_in.value = 0x7A
     await spell.push(PIN)
     await spell.exec_step("r")
     logic_data = spell.logic_read()
@@ -701,3 +1223,499 @@ async def test_intg_multiply(dut):
     assert logic_data["top"] == 110
 
     clock_sig.kill()
+
+
+@cocotb.test()
+async def test_reference_model(dut):
+    """
+    Checks that the Python reference model agrees with the RTL
+    """
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+
+    # fmt: off
+    programs = [
+        [66, 55, "-", "z"],
+        [0x88, 0xF0, "&", 0x88, 0xF0, "|", 0x88, 0xF0, "^", 0x88, ">", 0x88, "<", "z"],
+        [89, 96, "x", 12, "2", "z"],
+        [4, "?", "z", 0, 45],
+        [5, 3, "!", "z", "z"],
+        [0xF0, 0x36, "w", 0x55, 0x36, "w", 0x37, "r", "z"],
+        [10, 11, 1, "w", 0, "x", "x", 1, "r", "+", "x", 6, "@", 1, "r", "-", "z"],
+        [7, 4, "=", 0xFF, "z"],
+    ]
+    # fmt: on
+
+    for program in programs:
+        await reset(dut)
+        await spell.write_program(program)
+        await spell.execute()
+
+        model = SpellModel()
+        model.load_code(program)
+        model.run()
+
+        logic_data = spell.logic_read()
+        assert logic_data["pc"] == model.pc
+        assert logic_data["sp"] == model.sp
+        assert logic_data["top"] == model.top
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_backdoor_load(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    await spell.load_code([1, "r", 2, "w", 7, "?", "z", 0x42])
+    await spell.load_data([0, 77])
+    assert await spell.peek(0, 3) == bytes([1, ord("r"), 2])
+
+    await spell.execute()
+
+    logic_data = spell.logic_read()
+    assert logic_data["pc"] == 7
+    assert logic_data["sp"] == 1
+    assert logic_data["top"] == 0x42
+    assert await spell.peek(1, 2, data=True) == bytes([77, 77])
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_run_until(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    await spell.write_program([200, 1, "@", "z"])
+
+    cycles = await spell.run_until(cycles=100)
+    assert cycles >= 100
+    assert not spell.logic_read()["stopped"]
+    await spell.ensure_cpu_stopped()
+
+    await spell.set_pc(0)
+    await spell.set_sp(0)
+    await spell.run_until(pc=3)
+    logic_data = spell.logic_read()
+    assert logic_data["pc"] == 3
+    assert not logic_data["stopped"]
+    await spell.ensure_cpu_stopped()
+
+    await spell.set_pc(0)
+    await spell.set_sp(0)
+    cycles = await spell.run_until()
+    logic_data = spell.logic_read()
+    assert logic_data["pc"] == 4
+    assert logic_data["stopped"]
+    assert cycles > 200 * 2 * 3
+    assert dut.interrupt.value == 0
+
+    await spell.set_pc(0)
+    await spell.set_sp(0)
+    try:
+        await spell.run_until(timeout=1, timeout_unit="us")
+        assert False, "Expected a timeout"
+    except SimTimeoutError:
+        pass
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_lockstep_multiply(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    # fmt: off
+    program = [
+        10, 11,
+        1, 'w',
+        0, 'x',
+        'x', 1, 'r', '+',
+        'x', 6, '@',
+        1, 'r', '-',
+        'z',
+    ]
+    # fmt: on
+    model = SpellModel()
+    model.load_code(program)
+    await spell.load_code(program)
+
+    checker = LockstepChecker(dut, model)
+    await spell.execute()
+    checker.stop()
+
+    assert model.halted == "sleep"
+    assert checker.checked == model.retired
+    assert spell.logic_read()["top"] == 110
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_waveform_capture(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    # Dumps 50 cycles from the first loop jump, when run with +dump. With
+    # +dump_on, dumping goes back on afterwards for the rest of the run.
+    waveform = Waveform(dut)
+    dumping = waveform.enabled
+    waveform.stop()
+    await spell.write_program([0, 4, "x", 1, "+", "x", 2, "@", "z"])
+    await spell.set_pc(0)
+    capture = waveform.capture_at_pc(7, 50)
+    await spell.execute()
+    assert spell.logic_read()["top"] == 5
+    if waveform.available:
+        await capture
+    if dumping:
+        waveform.start()
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_trace_multiply(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    # fmt: off
+    program = [
+        10, 11,
+        1, 'w',
+        0, 'x',
+        'x', 1, 'r', '+',
+        'x', 6, '@',
+        1, 'r', '-',
+        'z',
+    ]
+    # fmt: on
+    model = SpellModel()
+    model.load_code(program)
+    pc_count = [0] * 256
+    while not model.halted:
+        pc_count[model.pc] += 1
+        model.step()
+
+    await spell.load_code(program)
+    trace = TraceRecorder(dut, await spell.clock_period_steps(), capacity=16)
+    cycles = await spell.run_until()
+    trace.stop()
+    dut._log.info("Profile:\n" + trace.report())
+
+    assert len(trace) == model.retired
+    assert list(trace.pc_count) == pc_count
+    entries = list(trace.entries())
+    assert [word & 0xFF for word, _ in entries[:3]] == [0, 1, 2]
+    assert sum(delta for _, delta in entries) == sum(trace.state_cycles().values())
+    # The core may be built with or without SPELL_DFF_DELAY
+    estimates = [CycleModel(delay).model_cycles(model) for delay in (0, DFF_DELAY_CYCLES)]
+    assert trace.state_cycles() in estimates
+    assert cycles == sum(trace.state_cycles().values())
+
+    clock_sig.kill()
+
+
+MULTIPLY_ASM = """
+    .equ A 10
+    .equ B 11
+    .equ TMP 1
+
+    B TMP w         ; data[TMP] = B
+    0 A 1 -         ; sum, counter: the loop runs counter + 1 times
+loop:
+    x TMP r + x
+    @loop
+    z
+"""
+
+
+@cocotb.test()
+async def test_assembler(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+
+    code = assemble(MULTIPLY_ASM)
+    optimized = assemble(MULTIPLY_ASM, optimize=True)
+    # fmt: off
+    assert optimized == [to_opcode(op) for op in [
+        11, 1, 'w',
+        0, 9,
+        'x', 1, 'r', '+', 'x', 5, '@',
+        'z',
+    ]]
+    # fmt: on
+    assert len(code) == len(optimized) + 2
+
+    for program in (code, optimized):
+        await reset(dut)
+        await spell.write_program(program)
+        await spell.execute()
+        logic_data = spell.logic_read()
+        assert logic_data["sp"] == 1
+        assert logic_data["top"] == 110
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_rambus_latency(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    spell.enable_rambus()
+
+    program = [0x55, 166, "w", 0x42, 142, "!", 100, "r", "z"]
+    model = SpellModel(256, 256)
+    model.data[100] = 78
+    model.load_code(program)
+    instructions = model.run()
+
+    # With a fixed latency, every access waits the same number of cycles
+    timing = CycleModel(sram=True, sram_latency=2)
+    await reset(dut)
+    spell.wbram.latency = 2
+    spell.wbram.reset_counters()
+    await spell.load_code(program)
+    spell.sram[256 + 100] = 78
+    cycles = await spell.run_until()
+    assert cycles == sum(timing.model_cycles(model).values())
+    assert spell.wbram.reads == instructions + 1
+    assert spell.wbram.writes == 2
+    assert spell.wbram.stall_cycles == 2 * (instructions + 3)
+    assert sum(spell.wbram.lane_counts) == instructions + 3
+    assert spell.logic_read()["top"] == 78
+
+    # Random data latency and a busy memory only cost time
+    no_wait = sum(CycleModel(sram=True).model_cycles(model).values())
+    for latency in (
+        RegionLatency([(CODE_REGION, 1), (DATA_REGION, RandomLatency(0, 5, seed=1))]),
+        BurstyLatency(period=16, busy=6),
+    ):
+        await reset(dut)
+        spell.wbram.latency = latency
+        spell.wbram.reset_counters()
+        await spell.load_code(program)
+        spell.sram[256 + 166] = 0
+        longer = await spell.run_until()
+        assert longer > no_wait
+        assert spell.wbram.stall_cycles > 0
+        assert spell.sram[256 + 166] == 0x55
+        assert spell.sram[142] == 0x42
+        assert spell.logic_read()["top"] == 78
+
+    spell.wbram.latency = 0
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_register_batch(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    batch = spell.batch()
+    for value in [10, 20, 30, 40, 50]:
+        batch.push(value)
+    batch.read(reg_sp)
+    batch.read(reg_stack_top)
+    batch.exec("+")
+    assert await batch.send() == [5, 50]
+
+    logic_data = spell.logic_read()
+    assert logic_data["sp"] == 4
+    assert logic_data["top"] == 90
+    assert logic_data["stopped"]
+
+    batch.set_sp(2)
+    batch.read(reg_stack_top)
+    batch.set_sp(1)
+    batch.read(reg_stack_top)
+    assert await batch.send() == [20, 10]
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_la_write_stream(dut):
+    spell = await create_spell(dut)
+    dut.i_la_wb_disable.value = True
+    spell.use_la_write = True
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    # Pushes need a gap after every write
+    stats = await spell.la_write_stream((reg_stack_push, value) for value in [1, 2, 3, 4, 5])
+    assert stats["writes"] == 5
+    assert stats["cycles"] == 9
+    logic_data = spell.logic_read()
+    assert logic_data["sp"] == 5
+    assert logic_data["top"] == 5
+
+    # Other registers take one write per cycle
+    stats = await spell.la_write_stream(
+        [(reg_pc, 7), (reg_cycles_per_ms, 100), (reg_sp, 3), (reg_stack_top, 42)]
+    )
+    assert stats["writes_per_cycle"] == 1.0
+    assert await spell.wb_read(reg_pc) == 7
+    assert await spell.wb_read(reg_cycles_per_ms) == 100
+    assert await spell.set_sp_read_stack(2) == 2
+    assert await spell.set_sp_read_stack(3) == 42
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_snapshot_restore(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+    if spell._code_mem is None:
+        dut._log.info("Skipping, the core's state is not visible in this simulation")
+        clock_sig.kill()
+        return
+
+    # Multiply, stopped halfway through the loop
+    # fmt: off
+    await spell.load_code([
+        10, 11,
+        1, 'w',
+        0, 'x',
+        'x', 1, 'r', '+',
+        'x', 6, '@',
+        1, 'r', '-',
+        0x1, 0x36, 'w',
+        'z',
+    ])
+    # fmt: on
+    await spell.wb_write(reg_cycles_per_ms, 1234)
+    await spell.run_until(cycles=300)
+    snapshot = await spell.snapshot()
+    state = spell.logic_read()
+    assert state["pc"] < 16
+
+    for _ in range(2):
+        await spell.execute()
+        logic_data = spell.logic_read()
+        assert logic_data["sp"] == 1
+        assert logic_data["top"] == 110
+        assert dut.io_out.value == 1
+
+        # Clobber some state, then go back to the snapshot
+        await spell.load_data([0xAA] * 8)
+        await spell.wb_write(reg_cycles_per_ms, 1)
+        await spell.restore(snapshot)
+        assert spell.logic_read() == state
+        assert await spell.peek(1, data=True) == bytes([11])
+        assert await spell.wb_read(reg_cycles_per_ms) == 1234
+        assert dut.io_out.value == 0
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_coverage(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    # Read PIN, store it in data[1], then sleep
+    await spell.write_program([0x36, "r", 1, "w", "z"])
+    coverage = Coverage()
+    coverage.start_test("test_coverage")
+    monitor = CoverageMonitor(dut, coverage)
+    await spell.execute()
+    await spell.set_pc(0)
+    await spell.single_step()
+    await spell.exec_step("2")
+    monitor.kill()
+    coverage.end_test()
+
+    def hit(name):
+        return coverage.counts[BINS.index(name)]
+
+    assert hit("opcode:literal") == 3
+    assert hit("mode:literal/run") == 2
+    assert hit("mode:literal/single_step") == 1
+    assert hit("mode:2/out_of_order") == 1
+    assert hit("operand:r/io") == 1
+    assert hit("operand:w/data_dff") == 1
+    assert hit("target:code_dff") == 6
+    assert hit("transition:Execute>Store") == 1
+    assert hit("transition:Sleep>Execute") == 1
+    assert hit("target:sram_code") == 0
+    assert coverage.tests["test_coverage"] == sum(
+        1 << index for index, count in enumerate(coverage.counts) if count
+    )
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_dump_state(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    program = [1, 2, 3, 42, 5, "w", 7, 0, "!", "z"]
+    model = SpellModel()
+    model.load_code(program)
+    model.run()
+    await spell.load_code(program)
+    await spell.execute()
+
+    state = await spell.dump_state()
+    assert state["sp"] == model.sp
+    assert state["stack"][: model.sp] == bytes(model.stack[: model.sp])
+    assert state["code"] == bytes(model.code[:DFF_CODE_SIZE])
+    assert state["data"] == bytes(model.data[:DFF_DATA_SIZE])
+
+    # The bus path reads the same, and leaves sp and the stack untouched
+    assert await spell.dump_state(bus=True) == state
+    assert await spell.dump_state() == state
+    assert spell.logic_read()["top"] == 3
+
+    clock_sig.kill()
+
+
+@cocotb.test()
+async def test_call_profile(dut):
+    spell = await create_spell(dut)
+    clock_sig = await make_clock(dut, 10)
+    await reset(dut)
+
+    spell.profile = CallProfile("test_call_profile")
+    program = [42, 58, "+", "z"]
+    await spell.write_program(program)
+    await spell.execute()
+    await spell.push(5)
+    await spell.exec_step("+")
+    assert spell.logic_read()["top"] == 105
+
+    profile = spell.profile
+    calls = profile.calls
+    for name in ("write_program", "execute", "push", "exec_step"):
+        assert calls[name].calls == 1
+    # Two pushes and an exec per byte, and a stop before and after every exec
+    assert calls["write_program"].wb_writes >= 3 * len(program)
+    assert calls["write_program"].wb_reads == 0
+    assert calls["write_program"].la_writes == 0
+    assert calls["ensure_cpu_stopped"].calls >= 2 * len(program) + 3
+    assert profile.cycles(calls["execute"]) > 0
+
+    report = profile.report()
+    assert "write_program" in report
+    total = profile.total
+    assert total.wb_writes >= calls["write_program"].wb_writes + calls["execute"].wb_writes
+    assert total.sim_steps >= sum(calls[name].sim_steps for name in ("write_program", "execute"))
+    dut._log.info("\n" + report)
+    spell.profile = None
+
+    clock_sig.kill()
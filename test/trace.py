@@ -0,0 +1,168 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Instruction trace recorder and hot-spot profiler for the spell core
+
+Usage example::
+
+    trace = TraceRecorder(dut, await spell.clock_period_steps())
+    await spell.execute()
+    trace.stop()
+    dut._log.info("\\n" + trace.report())
+
+Every retired instruction is stored as two 32-bit words: la_data_out as seen
+in the Execute state (pc, opcode, sp and stack top) and the number of clock
+cycles the instruction took, from its fetch until the next instruction starts.
+Entries are kept in an array('I') of `capacity` entries, which spills to a file
+when full, so long runs don't grow the Python heap. `entries()` reads the
+whole trace back through a memory map.
+
+Per-pc and per-opcode counters are kept as they go, split by core state
+(Fetch, FetchDat, Execute, Store, Delay), so the report is cheap even for
+traces that were spilled to disk.
+"""
+
+import mmap
+import tempfile
+from array import array
+
+from cocotb.utils import get_sim_time
+from test.retire_monitor import STATE_EXECUTE, RetireMonitor
+
+STATE_FETCH = 0
+STATE_SLEEP = 5
+PROFILE_STATES = ["Fetch", "FetchDat", "Execute", "Store", "Delay"]
+
+_NUM_STATES = 8
+
+
+class TraceRecorder(RetireMonitor):
+    def __init__(self, dut, clock_period, capacity=1 << 16, path=None):
+        """
+        `clock_period` is the clock period in simulator steps. Spilled entries go to
+        `path`, or to an anonymous temporary file.
+        """
+        self._period = clock_period
+        self._capacity = capacity
+        self._buffer = array("I")
+        self._path = path
+        self._file = None
+        self._spilled = 0
+        self._last_time = None
+        # The instruction in flight: its la_data_out word and cycles per state
+        self._word = None
+        self._pending = array("Q", bytes(8 * _NUM_STATES))
+        self.pc_count = array("Q", bytes(8 * 256))
+        self.pc_cycles = array("Q", bytes(8 * 256 * _NUM_STATES))
+        self.opcode_count = array("Q", bytes(8 * 256))
+        self.opcode_cycles = array("Q", bytes(8 * 256 * _NUM_STATES))
+        RetireMonitor.__init__(self, "trace", dut.la_data_out)
+
+    def stop(self):
+        self.kill()
+
+    def __len__(self):
+        return self._spilled + len(self._buffer) // 2
+
+    def _state_change(self, prev_state, value):
+        now = get_sim_time()
+        state = (value >> 21) & 0x7
+        if prev_state is not None and prev_state != STATE_SLEEP:
+            self._pending[prev_state] += (now - self._last_time) // self._period
+        self._last_time = now
+        if state in (STATE_FETCH, STATE_SLEEP) or (
+            state == STATE_EXECUTE and prev_state == STATE_SLEEP
+        ):
+            self._retire()
+        if state == STATE_EXECUTE:
+            self._word = value
+        RetireMonitor._state_change(self, prev_state, value)
+
+    def _retire(self):
+        word = self._word
+        if word is None:
+            return
+        self._word = None
+        pending = self._pending
+        pc = word & 0xFF
+        opcode = (word >> 8) & 0xFF
+        self.pc_count[pc] += 1
+        self.opcode_count[opcode] += 1
+        total = 0
+        for state in range(_NUM_STATES):
+            cycles = pending[state]
+            if cycles:
+                self.pc_cycles[pc * _NUM_STATES + state] += cycles
+                self.opcode_cycles[opcode * _NUM_STATES + state] += cycles
+                total += cycles
+                pending[state] = 0
+        buffer = self._buffer
+        buffer.append(word)
+        buffer.append(min(total, 0xFFFFFFFF))
+        if len(buffer) >= 2 * self._capacity:
+            self._spill()
+
+    def _spill(self):
+        if self._file is None:
+            self._file = open(self._path, "w+b") if self._path else tempfile.TemporaryFile()
+        self._buffer.tofile(self._file)
+        self._spilled += len(self._buffer) // 2
+        del self._buffer[:]
+
+    def entries(self):
+        """Yields (la_data_out word, cycles) for every recorded instruction, oldest first"""
+        if self._spilled:
+            self._file.flush()
+            with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                words = memoryview(mapped).cast("I")
+                try:
+                    for index in range(0, len(words), 2):
+                        yield words[index], words[index + 1]
+                finally:
+                    words.release()
+        buffer = self._buffer
+        for index in range(0, len(buffer), 2):
+            yield buffer[index], buffer[index + 1]
+
+    def state_cycles(self):
+        """Returns the total cycles spent in each state, by state name"""
+        totals = [0] * _NUM_STATES
+        cycles = self.pc_cycles
+        for index in range(len(cycles)):
+            totals[index % _NUM_STATES] += cycles[index]
+        return dict(zip(PROFILE_STATES, totals))
+
+    def report(self, limit=20):
+        """Formats the `limit` hottest pcs and all executed opcodes, by cycles spent"""
+        header = "%8s %8s" + " %8s" * len(PROFILE_STATES)
+        header = header % (("count", "cycles") + tuple(PROFILE_STATES))
+        lines = ["Instructions: %d, cycles per state: %s" % (len(self), self.state_cycles())]
+
+        def rows(label, counts, cycles, keys):
+            result = []
+            for key in keys:
+                split = cycles[key * _NUM_STATES : key * _NUM_STATES + len(PROFILE_STATES)]
+                result.append(
+                    "%-10s %8d %8d" % (label(key), counts[key], sum(split))
+                    + "".join(" %8d" % value for value in split)
+                )
+            return result
+
+        def total_cycles(cycles, key):
+            return sum(cycles[key * _NUM_STATES : (key + 1) * _NUM_STATES])
+
+        pcs = [pc for pc in range(256) if self.pc_count[pc]]
+        pcs.sort(key=lambda pc: -total_cycles(self.pc_cycles, pc))
+        lines.append("%-10s " % "pc" + header)
+        lines += rows(str, self.pc_count, self.pc_cycles, pcs[:limit])
+
+        opcodes = [opcode for opcode in range(256) if self.opcode_count[opcode]]
+        opcodes.sort(key=lambda opcode: -total_cycles(self.opcode_cycles, opcode))
+        lines.append("%-10s " % "opcode" + header)
+        lines += rows(_format_opcode, self.opcode_count, self.opcode_cycles, opcodes)
+        return "\n".join(lines)
+
+
+def _format_opcode(opcode):
+    return repr(chr(opcode)) if 0x20 < opcode < 0x7F else str(opcode)
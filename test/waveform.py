@@ -0,0 +1,79 @@
+# SPDX-FileCopyrightText: © 2021 Uri Shaked <uri@wokwi.com>
+# SPDX-License-Identifier: MIT
+
+"""
+Waveform capture control for the spell testbench
+
+Waveforms are off by default. Run the simulation with ``+dump`` (see
+test/dump_spell.v for the other plusargs), then choose what to capture from
+the test::
+
+    waveform = Waveform(dut)
+    waveform.capture_window(1000, 1500)  # clock cycles from now
+    waveform.capture_at_pc(12, 200)      # 200 cycles from when pc reaches 12
+
+or call ``start()`` / ``stop()`` directly. A capture leaves dumping as it
+found it when it ends, so it doesn't cut short a full-run dump with
+``+dump_on``. Without ``+dump``, or on the Verilator variants of test/sim.py,
+which have no dump module, all of these do nothing, so tests can leave them
+in place.
+"""
+
+import cocotb
+from cocotb import simulator
+from cocotb.handle import SimHandle
+from cocotb.triggers import ClockCycles, Edge
+
+
+class Waveform:
+    def __init__(self, dut):
+        self._dut = dut
+        self._enable = None
+        if cocotb.plusargs.get("dump"):
+            root = simulator.get_root_handle("dump")
+            if root is not None:
+                self._enable = SimHandle(root).enable
+
+    @property
+    def available(self):
+        return self._enable is not None
+
+    @property
+    def enabled(self):
+        return self._enable is not None and bool(self._enable.value)
+
+    def start(self):
+        if self._enable is not None:
+            self._enable.value = 1
+
+    def stop(self):
+        if self._enable is not None:
+            self._enable.value = 0
+
+    def capture_window(self, start_cycle, end_cycle):
+        """Captures clock cycles [start_cycle, end_cycle), counted from now"""
+        if self.available:
+            return cocotb.fork(self._window(start_cycle, end_cycle))
+
+    def capture_at_pc(self, pc, cycles):
+        """Captures `cycles` clock cycles, starting when the core reaches `pc`"""
+        if self.available:
+            return cocotb.fork(self._at_pc(pc, cycles))
+
+    async def _window(self, start_cycle, end_cycle):
+        if start_cycle:
+            await ClockCycles(self._dut.clock, start_cycle)
+        await self._capture(end_cycle - start_cycle)
+
+    async def _at_pc(self, pc, cycles):
+        la_data_out = self._dut.la_data_out
+        while la_data_out.value.integer & 0xFF != pc:
+            await Edge(la_data_out)
+        await self._capture(cycles)
+
+    async def _capture(self, cycles):
+        enabled = self.enabled
+        self.start()
+        await ClockCycles(self._dut.clock, cycles)
+        if not enabled:
+            self.stop()
@@ -19,7 +19,7 @@ Usage example::
     
     ram = WishboneRAM(dut, dut.rambus_wb_clk_o, ram_bus_signals)
 
-Then, in your test case, read/write from/to ``ram.data``. For example::
+Then, in your test case, read/write from/to ``ram.data`` (a ``bytearray``). For example::
 
     # Initialize the first byte of ram to 42
     ram.data[0] = 42
@@ -28,50 +28,237 @@ Then, in your test case, read/write from/to ``ram.data``. For example::
 
     # Assert that the user project set the 5th byte to 0x55
     assert ram.data[5] == 0x55
+
+The bus is served by a single coroutine that acks every request on the clock
+edge after it is strobed (classic Wishbone, one wait state), so the RAM can be
+made as large as needed without slowing down individual accesses.
+
+To model a slower or shared OpenRAM, pass a `latency`: a number of extra wait
+cycles, or one of the latency models below. Combine them per address region
+with `RegionLatency`, e.g. for the spell core's code (0-255) and data (256+)::
+
+    ram.latency = RegionLatency(
+        [(CODE_REGION, FixedLatency(1)), (DATA_REGION, RandomLatency(0, 4, seed=1))]
+    )
+
+``BurstyLatency`` models back-pressure from another master: while the RAM is
+busy, requests wait. The RAM counts reads, writes, stall cycles (cycles a
+strobed request waited for its ack) and accesses per byte lane.
 """
 
 
-from cocotbext.wishbone.monitor import WishboneSlave
+import random
+import struct
 
+import cocotb
+from cocotb.triggers import RisingEdge
 
-class WishboneRAMReader:
-    def __init__(self, data, wb_addr, base_address):
-        self._base_address = base_address
-        self._data = data
-        self._wb_addr = wb_addr
+_WORD = struct.Struct("<I")
+
+
+def _sel_runs(sel):
+    """Splits a byte select mask into (start, end) runs of contiguous byte lanes"""
+    runs = []
+    lane = 0
+    while lane < 4:
+        if sel & (1 << lane):
+            start = lane
+            while lane < 4 and sel & (1 << lane):
+                lane += 1
+            runs.append((start, lane))
+        else:
+            lane += 1
+    return tuple(runs)
+
+
+_SEL_RUNS = tuple(_sel_runs(sel) for sel in range(16))
+_SEL_LANES = tuple(tuple(lane for lane in range(4) if sel & (1 << lane)) for sel in range(16))
+
+# Wishbone address ranges of the spell core's code and data memory
+CODE_REGION = (0, 256)
+DATA_REGION = (256, 512)
+
+
+class FixedLatency:
+    """Every access waits `cycles` extra clock cycles"""
+
+    def __init__(self, cycles):
+        self.cycles = cycles
+
+    def wait_cycles(self, cycle, addr, write):
+        return self.cycles
+
+
+class RandomLatency:
+    """Every access waits between `low` and `high` extra clock cycles, uniformly"""
+
+    def __init__(self, low, high, seed=None):
+        self.low = low
+        self.high = high
+        self._rng = random.Random(seed)
+
+    def wait_cycles(self, cycle, addr, write):
+        return self._rng.randint(self.low, self.high)
 
-    def __iter__(self):
-        return self
 
-    def __next__(self):
-        addr = self._wb_addr.value & ~0x3  # 2 LSBs are always zero
-        addr -= self._base_address
-        value = (
-            self._data[addr]
-            | (self._data[addr+1] << 8)
-            | (self._data[addr+2] << 16)
-            | (self._data[addr+3] << 24))
-        return value
+class BurstyLatency:
+    """
+    The RAM is busy with another master for the first `busy` cycles of every
+    `period` clock cycles. Requests that arrive while it is busy wait until the
+    burst is over, then `cycles` more.
+    """
+
+    def __init__(self, period, busy, cycles=0, offset=0):
+        self.period = period
+        self.busy = busy
+        self.cycles = cycles
+        self.offset = offset
+
+    def wait_cycles(self, cycle, addr, write):
+        phase = (cycle - self.offset) % self.period
+        return max(self.busy - phase, 0) + self.cycles
+
+
+class RegionLatency:
+    """Selects a latency by address: `regions` is a list of ((start, end), latency)"""
+
+    def __init__(self, regions, default=0):
+        self.regions = [(start, end, _latency_model(latency)) for (start, end), latency in regions]
+        self.default = _latency_model(default)
+
+    def wait_cycles(self, cycle, addr, write):
+        for start, end, latency in self.regions:
+            if start <= addr < end:
+                return latency.wait_cycles(cycle, addr, write) if latency else 0
+        return self.default.wait_cycles(cycle, addr, write) if self.default else 0
+
+
+def _latency_model(latency):
+    """Turns a number of wait cycles into a latency model, and 0 into None"""
+    if not latency:
+        return None
+    if isinstance(latency, int):
+        return FixedLatency(latency)
+    return latency
 
 
 class WishboneRAM:
-    def __init__(self, dut, clk, signals_dict, size=1024, base_address=0):
+    def __init__(self, dut, clk, signals_dict, size=1024, base_address=0, latency=0):
         self._dut = dut
+        self._clk = clk
         self._base_address = base_address
-        self.data = [0] * size
-        adr_signal = getattr(self._dut, signals_dict['adr'])
-        ram_reader = WishboneRAMReader(self.data, adr_signal, base_address)
-        self._ram_bus = WishboneSlave(
-            dut, "", clk, width=32, signals_dict=signals_dict, datgen=ram_reader)
-        self._ram_bus.add_callback(self.rambus_callback)
-
-    def rambus_callback(self, transactions):
-        for transaction in transactions:
-            sel = transaction.sel
-            if transaction.datwr:
-                start_addr = transaction.adr & ~0x3  # 2 LSBs are always zero
-                start_addr -= self._base_address
-                for b in range(4):
-                    if sel & (1 << b):
-                        addr = start_addr + b
-                        self.data[addr] = (transaction.datwr >> (b*8)) & 0xff
+        self.data = bytearray(size)
+        self.latency = latency
+        self.reset_counters()
+        self._signals = {
+            name: getattr(dut, signal) for name, signal in signals_dict.items()
+        }
+        self._responder = None
+        self.start()
+
+    def start(self):
+        """
+        Starts serving the bus. cocotb kills the responder at the end of every test,
+        so a RAM that outlives a test must be started again in the next one.
+        """
+        self.close()
+        self._signals["ack"].setimmediatevalue(0)
+        self._signals["datrd"].setimmediatevalue(0)
+        self._responder = cocotb.fork(self._respond())
+
+    def close(self):
+        if self._responder is not None and not self._responder.done():
+            self._responder.kill()
+            self._responder = None
+
+    @property
+    def latency(self):
+        return self._latency
+
+    @latency.setter
+    def latency(self, latency):
+        self._latency = _latency_model(latency)
+
+    def reset_counters(self):
+        self.reads = 0
+        self.writes = 0
+        self.stall_cycles = 0
+        self.lane_counts = [0] * 4
+
+    def counters(self):
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+            "stall_cycles": self.stall_cycles,
+            "lane_counts": list(self.lane_counts),
+        }
+
+    def read_word(self, addr):
+        return _WORD.unpack_from(self.data, addr - self._base_address)[0]
+
+    def write_word(self, addr, value, sel=0xF):
+        word = value.to_bytes(4, "little")
+        start_addr = addr - self._base_address
+        for start, end in _SEL_RUNS[sel]:
+            self.data[start_addr + start : start_addr + end] = word[start:end]
+
+    async def _respond(self):
+        clkedge = RisingEdge(self._clk)
+        signals = self._signals
+        cyc = signals["cyc"]
+        stb = signals["stb"]
+        we = signals["we"]
+        adr = signals["adr"]
+        sel = signals.get("sel")
+        datwr = signals["datwr"]
+        datrd = signals["datrd"]
+        ack = signals["ack"]
+        data = self.data
+        size = len(data)
+        base_address = self._base_address
+        unpack_from = _WORD.unpack_from
+        sel_runs = _SEL_RUNS
+        sel_lanes = _SEL_LANES
+        acked = False
+        cycle = 0
+        waiting = None
+
+        while True:
+            await clkedge
+            cycle += 1
+            if acked:
+                # Classic Wishbone: ack for a single cycle, then wait for the next strobe
+                ack.value = 0
+                acked = False
+                continue
+            if cyc.value.binstr != "1" or stb.value.binstr != "1":
+                waiting = None
+                continue
+            write = we.value.binstr == "1"
+            bus_addr = adr.value.integer & ~0x3  # 2 LSBs are always zero
+            latency = self._latency
+            if latency is not None:
+                if waiting is None:
+                    waiting = latency.wait_cycles(cycle, bus_addr, write)
+                if waiting > 0:
+                    waiting -= 1
+                    self.stall_cycles += 1
+                    continue
+                waiting = None
+            addr = bus_addr - base_address
+            in_range = 0 <= addr <= size - 4
+            lanes = sel.value.integer if sel is not None else 0xF
+            lane_counts = self.lane_counts
+            for lane in sel_lanes[lanes]:
+                lane_counts[lane] += 1
+            if write:
+                self.writes += 1
+                if in_range:
+                    word = datwr.value.integer.to_bytes(4, "little")
+                    for start, end in sel_runs[lanes]:
+                        data[addr + start : addr + end] = word[start:end]
+            else:
+                self.reads += 1
+                datrd.value = unpack_from(data, addr)[0] if in_range else 0
+            ack.value = 1
+            acked = True